@@ -0,0 +1,209 @@
+"""
+Running aggregates over the combined records server.py logs, so per-condition summaries of
+gaze_log.csv can be queried live (the 'analyticsQuery' message) instead of re-reading the file.
+
+Every logged row updates one accumulator row per grouping: overall, by participant, by Robot,
+by difficulty and every combination of those (GROUPINGS), so any query is answered from the
+accumulators without touching the individual turns. Accumulators are stored column-wise: one
+array per statistic, one entry per group. Per group:
+    turns          combined records logged
+    move_duration  count, mean and standard deviation (Welford), min/max, and p50/p95 from a
+                   quantile sketch (QuantileSketch over milliseconds), as logged (i.e. after the
+                   Carl condition offset, so values can be negative)
+    accuracy       participants_side_choice == correct_side, over turns that have both
+    gaze           over turns where the robot gave a gaze cue (gazeDecision left/right): how often
+                   it pointed to the correct side, and how often the participant chose that side
+"""
+import math
+from array import array
+from itertools import combinations
+
+from metrics import LatencyHistogram
+
+DIMENSIONS = ('participant', 'Robot', 'difficulty')
+# Every subset of DIMENSIONS, in DIMENSIONS order: (), ('participant',), ..., ('participant', 'Robot', 'difficulty')
+GROUPINGS = tuple(grouping for n in range(len(DIMENSIONS) + 1) for grouping in combinations(DIMENSIONS, n))
+
+# gazeDecision values that are a cue to one side ('none' means the robot did not look)
+GAZE_CUES = ('left', 'right')
+
+_COUNT_COLUMNS = ('turns', 'graded', 'correct', 'cued', 'cue_correct', 'cue_followed')
+
+
+class QuantileSketch:
+    """
+    metrics.LatencyHistogram extended to negative values: one histogram per sign, by magnitude.
+    """
+    __slots__ = ('positive', 'negative')
+
+    def __init__(self):
+        self.positive = LatencyHistogram()
+        self.negative = LatencyHistogram()
+
+    def add(self, value):
+        if value < 0:
+            self.negative.add(-value)
+        else:
+            self.positive.add(value)
+
+    def quantile(self, q):
+        negatives, positives = self.negative.count, self.positive.count
+        if not negatives + positives:
+            return None
+        rank = q * (negatives + positives - 1)
+        if rank < negatives:
+            # Ascending values are descending magnitudes on the negative side
+            return -self.negative.quantile((negatives - 1 - rank) / max(1, negatives - 1))
+        return self.positive.quantile((rank - negatives) / max(1, positives - 1))
+
+
+class GroupedAccumulators:
+    """
+    Accumulators for one grouping (a tuple of DIMENSIONS): one row per group, one array per statistic.
+    """
+
+    def __init__(self, dimensions):
+        self.dimensions = dimensions
+        self.rows = {}  # group key (tuple of dimension values) -> row index
+        self.counts = {name: array('q') for name in _COUNT_COLUMNS}
+        self.duration_count = array('q')
+        self.duration_mean = array('d')
+        self.duration_m2 = array('d')  # sum of squared deviations from the mean (Welford)
+        self.duration_min = array('d')
+        self.duration_max = array('d')
+        self.duration_sketches = []    # QuantileSketch of move_duration in ms, per row
+
+    def _row(self, key):
+        row = self.rows.get(key)
+        if row is None:
+            row = self.rows[key] = len(self.duration_count)
+            for column in self.counts.values():
+                column.append(0)
+            self.duration_count.append(0)
+            self.duration_mean.append(0.0)
+            self.duration_m2.append(0.0)
+            self.duration_min.append(math.inf)
+            self.duration_max.append(-math.inf)
+            self.duration_sketches.append(QuantileSketch())
+        return row
+
+    def add(self, key, duration, correct, cue_correct, cue_followed):
+        """
+        correct / cue_correct / cue_followed are True, False, or None (not applicable).
+        """
+        row = self._row(key)
+        counts = self.counts
+        counts['turns'][row] += 1
+        if correct is not None:
+            counts['graded'][row] += 1
+            counts['correct'][row] += correct
+        if cue_correct is not None:
+            counts['cued'][row] += 1
+            counts['cue_correct'][row] += cue_correct
+            counts['cue_followed'][row] += bool(cue_followed)
+        if duration is not None:
+            n = self.duration_count[row] = self.duration_count[row] + 1
+            delta = duration - self.duration_mean[row]
+            self.duration_mean[row] += delta / n
+            self.duration_m2[row] += delta * (duration - self.duration_mean[row])
+            self.duration_min[row] = min(self.duration_min[row], duration)
+            self.duration_max[row] = max(self.duration_max[row], duration)
+            self.duration_sketches[row].add(duration * 1000)
+
+    def summary(self, key):
+        row = self.rows[key]
+        counts = {name: column[row] for name, column in self.counts.items()}
+        n = self.duration_count[row]
+        duration = {'count': n}
+        if n:
+            sketch = self.duration_sketches[row]
+            duration.update({
+                'mean': round(self.duration_mean[row], 4),
+                'std': round(math.sqrt(self.duration_m2[row] / (n - 1)), 4) if n > 1 else None,
+                'min': round(self.duration_min[row], 4),
+                'p50': round(sketch.quantile(0.50) / 1000, 4),
+                'p95': round(sketch.quantile(0.95) / 1000, 4),
+                'max': round(self.duration_max[row], 4),
+            })
+        return {
+            'group': dict(zip(self.dimensions, key)),
+            'turns': counts['turns'],
+            'move_duration_s': duration,
+            'accuracy': _rate(counts['correct'], counts['graded']),
+            'graded': counts['graded'],
+            'gaze': {
+                'cued': counts['cued'],
+                'cue_correct': _rate(counts['cue_correct'], counts['cued']),
+                'followed': _rate(counts['cue_followed'], counts['cued']),
+            },
+        }
+
+
+def _rate(hits, total):
+    return round(hits / total, 4) if total else None
+
+
+def _parse_duration(value):
+    try:
+        duration = float(value)
+    except (TypeError, ValueError):
+        return None
+    return duration if math.isfinite(duration) else None
+
+
+class TurnAnalytics:
+    """
+    Aggregates for every grouping in GROUPINGS, fed one combined CSV row (server.build_csv_row) at a time.
+    """
+
+    def __init__(self):
+        self.groupings = {grouping: GroupedAccumulators(grouping) for grouping in GROUPINGS}
+
+    @property
+    def turns(self):
+        overall = self.groupings[()]
+        return overall.counts['turns'][0] if overall.rows else 0
+
+    def add(self, row):
+        choice = row.get('participants_side_choice') or None
+        side = row.get('correct_side') or None
+        cue = row.get('gazeDecision')
+        cue = cue if cue in GAZE_CUES else None
+        correct = None if choice is None or side is None else choice == side
+        cue_correct = None if cue is None or side is None else cue == side
+        cue_followed = None if cue is None else cue == choice
+        duration = _parse_duration(row.get('move_duration'))
+        for grouping, accumulators in self.groupings.items():
+            key = tuple(row.get(dimension) or '' for dimension in grouping)
+            accumulators.add(key, duration, correct, cue_correct, cue_followed)
+
+    def query(self, group_by=(), filters=None):
+        """
+        Summaries per group of `group_by` (any of DIMENSIONS), restricted to the groups matching
+        `filters` ({dimension: value}). Raises ValueError for an unknown dimension or a malformed
+        argument (the query comes straight from a client message).
+        """
+        if isinstance(group_by, str):
+            group_by = (group_by,)
+        if not isinstance(group_by, (list, tuple)) or not all(isinstance(d, str) for d in group_by):
+            raise ValueError("groupBy must be a dimension name or a list of them")
+        filters = filters or {}
+        if not isinstance(filters, dict):
+            raise ValueError("filter must be an object of {dimension: value}")
+        unknown = (set(group_by) | set(filters)) - set(DIMENSIONS)
+        if unknown:
+            raise ValueError(f"unknown dimension(s) {sorted(unknown)}; expected any of {list(DIMENSIONS)}")
+        grouping = tuple(dimension for dimension in DIMENSIONS if dimension in group_by or dimension in filters)
+        accumulators = self.groupings[grouping]
+        positions = {dimension: grouping.index(dimension) for dimension in filters}
+        return [accumulators.summary(key) for key in sorted(accumulators.rows)
+                if all(key[positions[dimension]] == value for dimension, value in filters.items())]
+
+    def report(self):
+        """
+        Overall summary plus one breakdown per dimension, e.g. for a JSON file.
+        """
+        report = {'overall': self.query()}
+        for dimension in DIMENSIONS:
+            report[f'by_{dimension}'] = self.query((dimension,))
+        return report
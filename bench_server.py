@@ -0,0 +1,448 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import websockets
+
+import wire
+from metrics import LatencyHistogram
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_SCRIPT = os.path.join(BASE_DIR, 'server.py')
+QUESTIONS_CSV = os.path.join(BASE_DIR, 'sortingGame', 'data', 'quiz_question.csv')
+
+ROBOT_CONDITIONS = ["Ryan condition", "Ivan condition", "Carl condition"]
+
+# How often the monitor queries the running analytics during the run
+MONITOR_INTERVAL_SECONDS = 0.5
+
+# Representative messages for the in-process encoding comparison (see encoding_benchmark)
+SAMPLE_FACE_DETECTION = {
+    'event': 'faceDetection', 'userInFront': True, 'headDirection': 'Looking Left',
+    'gazeDirection': 'Looking At Cards', 'faceX': 0.4821, 'faceY': 0.3917, 'secondFaceX': None,
+    'secondFaceY': None, 'headYaw': -21.37, 'headPitch': 4.12, 'headRoll': 1.08, 'gazeX': -0.211,
+    'gazeY': 0.164, 'irisX': 0.4634, 'irisY': 0.3712,
+    'timestamps': {'headPose': 1760000000123, 'gaze': 1760000000098},
+}
+SAMPLE_CARD_REVEAL = {
+    'action': 'logGame', 'event': 'cardReveal', 'turn': 'participant', 'participant': 'bench-001',
+    'cardId': 'v7', 'round': 2, 'questionIndex': 7, 'question': 'Is the Pacific the largest ocean on Earth?',
+    'difficulty': 'easy', 'answer': True, 'side': 'left',
+}
+
+
+def load_questions(path=QUESTIONS_CSV):
+    """
+    Loads the real question set (practice questions excluded) as the game would send it.
+    Like the game, cards are numbered v1, v2, ... within each round.
+    """
+    questions = []
+    per_round = {}
+    with open(path, newline='', encoding='utf-8-sig') as csvfile:
+        for row in csv.DictReader(csvfile):
+            if row['Round'].strip().lower() == 'test':
+                continue
+            per_round[row['Round']] = per_round.get(row['Round'], 0) + 1
+            answer = row['correct_answer'].strip().upper() == 'TRUE'
+            questions.append({
+                'cardId': f"v{per_round[row['Round']]}",
+                'round': int(row['Round']),
+                'questionIndex': per_round[row['Round']],
+                'question': row['question'],
+                'difficulty': row['difficulty'],
+                'answer': answer,
+                'side': 'left' if answer else 'right',
+            })
+    return questions
+
+
+class BenchStats:
+    """
+    Client-side counters and round-trip histograms (nanoseconds).
+    """
+
+    def __init__(self, binary=False):
+        self.binary = binary                        # msgpack (wire.EVENTS_PROTOCOL) instead of JSON
+        self.sent = 0
+        self.received = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.turns_logged = 0
+        self.reveal_rtt = LatencyHistogram()       # cardReveal sent -> status reply
+        self.forward = LatencyHistogram()          # cardReveal sent -> GCS receives it
+        self.robots_move_rtt = LatencyHistogram()  # RobotsMove sent -> status reply
+        self.drop_rtt = LatencyHistogram()         # cardDropped sent -> status reply
+        self.analytics_rtt = LatencyHistogram()    # analyticsQuery sent -> reply (monitor)
+        self.analytics = None                      # last analyticsQuery reply
+
+
+class Station:
+    """
+    State shared by the simulated game and GCS of one participant.
+    """
+
+    def __init__(self, participant):
+        self.participant = participant
+        self.reveal_sent_ns = 0
+        self.answered = asyncio.Event()
+
+
+def connect(url, stats):
+    subprotocols = [wire.EVENTS_PROTOCOL] if stats.binary else None
+    return websockets.connect(url, max_queue=None, subprotocols=subprotocols)
+
+
+async def send(ws, stats, message):
+    data = wire.encode_event(message) if ws.subprotocol == wire.EVENTS_PROTOCOL else json.dumps(message)
+    stats.bytes_sent += len(data) if isinstance(data, bytes) else len(data.encode('utf-8'))
+    await ws.send(data)
+
+
+def decode(stats, data):
+    if isinstance(data, bytes):
+        stats.bytes_received += len(data)
+        return wire.decode_event(data)
+    stats.bytes_received += len(data.encode('utf-8'))
+    return json.loads(data)
+
+
+async def receive_status(ws, stats):
+    while True:
+        message = decode(stats, await ws.recv())
+        stats.received += 1
+        if 'status' in message:
+            return message
+
+
+async def run_game(url, station, questions, stats, think_time):
+    async with connect(url, stats) as ws:
+        await send(ws, stats, {'event': 'subscribe', 'topics': []})
+        await receive_status(ws, stats)
+
+        for question in questions:
+            common = dict(question, participant=station.participant)
+            station.answered.clear()
+
+            station.reveal_sent_ns = time.perf_counter_ns()
+            await send(ws, stats, dict(common, action='logGame', event='cardReveal', turn='participant'))
+            stats.sent += 1
+            await receive_status(ws, stats)
+            stats.reveal_rtt.add(time.perf_counter_ns() - station.reveal_sent_ns)
+
+            await station.answered.wait()
+            if think_time:
+                await asyncio.sleep(think_time)
+
+            side_choice = random.choice(['left', 'right'])
+            sent_ns = time.perf_counter_ns()
+            await send(ws, stats, dict(common, action='logGameChoice', event='cardDropped', side_choice=side_choice))
+            stats.sent += 1
+            status = await receive_status(ws, stats)
+            stats.drop_rtt.add(time.perf_counter_ns() - sent_ns)
+            if status['status'] == 'combined record logged':
+                stats.turns_logged += 1
+
+
+async def run_gcs(url, station, stats, subscribed):
+    async with connect(url, stats) as ws:
+        await send(ws, stats, {'event': 'subscribe', 'topics': ['cardReveal'], 'participant': station.participant})
+        await receive_status(ws, stats)
+        subscribed.set()
+
+        robots_move_sent = []
+        async for raw in ws:
+            message = decode(stats, raw)
+            stats.received += 1
+            if message.get('event') == 'cardReveal':
+                stats.forward.add(time.perf_counter_ns() - station.reveal_sent_ns)
+                robot = random.choice(ROBOT_CONDITIONS)
+                robots_move_sent.append(time.perf_counter_ns())
+                await send(ws, stats, {
+                    'action': 'logEvent', 'event': 'RobotsMove', 'participant': station.participant,
+                    'cardId': message['cardId'], 'Robot': robot,
+                    'gazeDecision': 'none' if robot == 'Carl condition' else message['side'],
+                    'reason': '', 'timestamp': int(time.time() * 1000),
+                })
+                stats.sent += 1
+            elif 'status' in message and robots_move_sent:
+                stats.robots_move_rtt.add(time.perf_counter_ns() - robots_move_sent.pop(0))
+                station.answered.set()
+
+
+async def query(ws, request, reply_event):
+    # Monitor traffic is not part of the measured load, so it is not counted
+    uncounted = BenchStats()
+    await send(ws, uncounted, request)
+    while True:
+        message = decode(uncounted, await ws.recv())
+        if message.get('event') == reply_event:
+            return message
+
+
+async def query_status(ws):
+    return await query(ws, {'event': 'serverStatus'}, 'serverStatus')
+
+
+async def query_analytics(ws, stats):
+    """
+    Asks for the running aggregates by Robot condition and times the round trip.
+    """
+    sent_ns = time.perf_counter_ns()
+    reply = await query(ws, {'event': 'analyticsQuery', 'groupBy': ['Robot']}, 'analytics')
+    stats.analytics_rtt.add(time.perf_counter_ns() - sent_ns)
+    return reply
+
+
+async def monitor(url, stats, done):
+    """
+    Queries the running analytics while the benchmark runs (as an experimenter checking data live
+    would), then returns the final serverStatus with the server's own peak open turns and memory.
+    """
+    async with connect(url, stats) as ws:
+        await send(ws, BenchStats(), {'event': 'subscribe', 'topics': []})
+        while not done.is_set():
+            await query_analytics(ws, stats)
+            try:
+                await asyncio.wait_for(done.wait(), MONITOR_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+        stats.analytics = await query_analytics(ws, stats)
+        return await query_status(ws)
+
+
+async def run_benchmark(url, participants, questions, think_time, binary):
+    stats = BenchStats(binary)
+    stations = [Station(f"bench-{i + 1:03d}") for i in range(participants)]
+
+    # Connect every GCS first so no cardReveal is forwarded before its subscriber exists
+    gcs_tasks = []
+    for station in stations:
+        subscribed = asyncio.Event()
+        gcs_tasks.append(asyncio.create_task(run_gcs(url, station, stats, subscribed)))
+        await subscribed.wait()
+
+    done = asyncio.Event()
+    monitor_task = asyncio.create_task(monitor(url, stats, done))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_game(url, station, questions, stats, think_time) for station in stations))
+    elapsed = time.perf_counter() - started
+
+    done.set()
+    server_status = await monitor_task
+    for task in gcs_tasks:
+        task.cancel()
+    await asyncio.gather(*gcs_tasks, return_exceptions=True)
+    return stats, elapsed, server_status
+
+
+def time_per_call_us(function, argument, iterations):
+    started = time.perf_counter_ns()
+    for _ in range(iterations):
+        function(argument)
+    return round((time.perf_counter_ns() - started) / iterations / 1000, 3)
+
+
+def encoding_benchmark(iterations):
+    """
+    Size and encode/decode cost per message of each wire format, measured in-process:
+    faceDetection as JSON vs the struct frame, and a cardReveal event as JSON vs msgpack.
+    """
+    formats = {
+        'faceDetection': (SAMPLE_FACE_DETECTION, {
+            'json': (json.dumps, json.loads),
+            'struct': (wire.encode_face_detection, wire.decode_face_detection),
+        }),
+        'cardReveal': (SAMPLE_CARD_REVEAL, {
+            'json': (json.dumps, json.loads),
+            'msgpack': (wire.encode_event, wire.decode_event) if wire.msgpack is not None else None,
+        }),
+    }
+    results = {}
+    for name, (message, codecs) in formats.items():
+        results[name] = {}
+        for codec, functions in codecs.items():
+            if functions is None:
+                continue  # msgpack not installed
+            encode, decode = functions
+            data = encode(message)
+            results[name][codec] = {
+                'bytes': len(data) if isinstance(data, bytes) else len(data.encode('utf-8')),
+                'encode_us': time_per_call_us(encode, message, iterations),
+                'decode_us': time_per_call_us(decode, data, iterations),
+            }
+    return results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for_server(url, process, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        if process.poll() is not None:
+            raise SystemExit(f"Error: server exited with code {process.returncode} during startup")
+        try:
+            async with websockets.connect(url):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise SystemExit(f"Error: server did not start listening on {url}")
+            await asyncio.sleep(0.1)
+
+
+def stop_server(process):
+    """
+    Stops the server like Ctrl-C would, so it flushes its CSV writer before exiting.
+    """
+    if sys.platform == 'win32':
+        process.terminate()
+    else:
+        process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def count_csv_rows(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path, newline='', encoding='utf-8') as csvfile:
+        return max(0, sum(1 for _ in csv.reader(csvfile)) - 1)
+
+
+def build_report(args, stats, elapsed, server_status, csv_rows):
+    expected_turns = args.participants * args.cards
+    return {
+        'participants': args.participants,
+        'cards_per_participant': args.cards,
+        'wire': args.wire,
+        'elapsed_s': round(elapsed, 3),
+        'messages_sent': stats.sent,
+        'messages_received': stats.received,
+        'messages_per_second': round((stats.sent + stats.received) / elapsed, 1),
+        'bytes_sent': stats.bytes_sent,
+        'bytes_received': stats.bytes_received,
+        'turns_per_second': round(stats.turns_logged / elapsed, 1),
+        'turns_logged': stats.turns_logged,
+        'csv_rows_written': csv_rows,
+        'csv_rows_expected': expected_turns,
+        'peak_open_turns': server_status['sessions']['peak_open_turns'],
+        'peak_open_turns_bytes': server_status['sessions']['peak_open_turns_bytes'],
+        'server_peak_rss_mb': server_status.get('peak_rss_mb'),
+        'client_rtt_ms': {
+            'cardReveal': stats.reveal_rtt.snapshot(),
+            'forward_to_gcs': stats.forward.snapshot(),
+            'RobotsMove': stats.robots_move_rtt.snapshot(),
+            'cardDropped': stats.drop_rtt.snapshot(),
+            'analyticsQuery': stats.analytics_rtt.snapshot(),
+        },
+        'analytics_turns': stats.analytics['turns'] if stats.analytics else None,
+        'analytics_by_robot': stats.analytics['groups'] if stats.analytics else [],
+        'server_latency_ms': server_status.get('latency_ms', {}),
+        'encoding': encoding_benchmark(args.encoding_iterations),
+    }
+
+
+def print_report(report):
+    print(f"\n{report['participants']} participants x {report['cards_per_participant']} cards "
+          f"in {report['elapsed_s']:.2f} s ({report['wire']} wire format)")
+    print(f"  messages:     {report['messages_sent']} sent, {report['messages_received']} received "
+          f"({report['messages_per_second']:.0f} msg/s)")
+    print(f"  bytes:        {report['bytes_sent']} sent, {report['bytes_received']} received "
+          f"({(report['bytes_sent'] + report['bytes_received']) / max(1, report['messages_sent'] + report['messages_received']):.0f} B/msg)")
+    print(f"  turns:        {report['turns_logged']} logged ({report['turns_per_second']:.1f} turns/s)")
+    print(f"  CSV rows:     {report['csv_rows_written']} written, {report['csv_rows_expected']} expected")
+    print(f"  open turns:   peak {report['peak_open_turns']} (~{report['peak_open_turns_bytes'] / 1024:.1f} KiB), "
+          f"server peak RSS {report['server_peak_rss_mb']} MB")
+    print("  client round trips (ms):")
+    for name, summary in report['client_rtt_ms'].items():
+        if summary['count']:
+            print(f"    {name:<15} p50 {summary['p50']:8.3f}  p95 {summary['p95']:8.3f}  "
+                  f"p99 {summary['p99']:8.3f}  max {summary['max']:8.3f}")
+    print(f"  analytics:    {report['analytics_turns']} turns aggregated")
+    for group in report['analytics_by_robot']:
+        duration = group['move_duration_s']
+        print(f"    {group['group']['Robot']:<15} {group['turns']:5d} turns  move_duration mean {duration.get('mean')} s "
+              f"(sd {duration.get('std')})  accuracy {group['accuracy']}  gaze followed {group['gaze']['followed']}")
+    print("  encoding per message (in-process):")
+    for name, codecs in report['encoding'].items():
+        for codec, result in codecs.items():
+            print(f"    {name:<15} {codec:<8} {result['bytes']:5d} B  encode {result['encode_us']:7.3f} us  "
+                  f"decode {result['decode_us']:7.3f} us")
+
+
+async def main(args):
+    questions = load_questions()
+    if args.cards:
+        questions = (questions * (args.cards // len(questions) + 1))[:args.cards]
+    args.cards = len(questions)
+
+    with tempfile.TemporaryDirectory(prefix='bench_server_') as tmpdir:
+        workdir = args.workdir or tmpdir
+        os.makedirs(workdir, exist_ok=True)
+        csv_path = os.path.join(workdir, 'gaze_log.csv')
+        port = args.port or free_port()
+        url = f"ws://127.0.0.1:{port}"
+
+        with open(os.path.join(workdir, 'server.log'), 'w') as server_log:
+            process = subprocess.Popen(
+                [sys.executable, SERVER_SCRIPT, '--host', '127.0.0.1', '--port', str(port), '--csv', csv_path,
+                 '--partial-csv', os.path.join(workdir, 'gaze_log_partial.csv')],
+                cwd=workdir, stdout=server_log, stderr=subprocess.STDOUT)
+            try:
+                await wait_for_server(url, process)
+                print(f"Server running on {url} (output in {server_log.name})")
+                stats, elapsed, server_status = await run_benchmark(url, args.participants, questions, args.think_time,
+                                                                    binary=args.wire == 'msgpack')
+            finally:
+                stop_server(process)
+
+        report = build_report(args, stats, elapsed, server_status, count_csv_rows(csv_path))
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.json}")
+    return report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Load test for server.py: simulated sorting-game and GCS clients for N concurrent participants.")
+    parser.add_argument('-n', '--participants', type=int, default=10, help="concurrent participants (default: 10)")
+    parser.add_argument('--cards', type=int, default=0,
+                        help="cards per participant (default: the full question set, repeated if larger)")
+    parser.add_argument('--think-time', type=float, default=0.0,
+                        help="seconds between the GCS answer and the card drop (default: 0, as fast as possible)")
+    parser.add_argument('--port', type=int, default=0, help="server port (default: a free port)")
+    parser.add_argument('--workdir', help="keep the server's CSV and output here instead of a temp directory")
+    parser.add_argument('--wire', choices=['json', 'msgpack'], default='json',
+                        help="message format of the simulated clients; msgpack negotiates wire.EVENTS_PROTOCOL "
+                             "(default: json)")
+    parser.add_argument('--encoding-iterations', type=int, default=20000,
+                        help="iterations per format in the in-process encoding comparison (default: 20000)")
+    parser.add_argument('--json', help="also write the report to this JSON file (for regression tracking)")
+    args = parser.parse_args()
+    if args.wire == 'msgpack' and wire.msgpack is None:
+        parser.error("--wire msgpack needs the msgpack package")
+    return args
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
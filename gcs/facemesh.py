@@ -0,0 +1,208 @@
+"""
+FaceMesh landmarks: the lazy cv2 / mediapipe import, FaceTracker (FaceMesh with region-of-interest
+tracking), the (faces x 478 x 3) landmark array and head pose. Used by perception.py, replay.py
+(through perception) and the gaze process (gaze.py), which needs no part of the WebSocket node.
+"""
+import threading
+import time
+
+import numpy as np
+
+# cv2 and mediapipe take about a second to import, so they are not imported here but by
+# load_vision_modules(), on first use (see perception.load_vision_modules)
+cv2 = None
+mp = None
+
+# MediaPipe FaceMesh, set by load_vision_modules()
+mp_face_mesh = None
+
+# FaceMesh landmark indices used for head pose
+NUM_LANDMARKS = 478  # 468 mesh points + 10 iris points (refine_landmarks=True)
+NOSE_TIP = 1
+FOREHEAD = 10
+CHIN = 152
+LEFT_EYE_INNER = 133
+RIGHT_EYE_INNER = 362
+
+# Region-of-interest tracking (see FaceTracker)
+ROI_SIZE = 256            # side (px) of the square crop FaceMesh sees while tracking
+ROI_MARGIN = 0.3          # the crop is the faces' bounding box grown by this fraction on every side
+ROI_MIN_SIDE = 64         # px; smallest crop taken from the camera frame
+REDETECT_INTERVAL = 30    # search the full frame at least every N frames (e.g. for a second face)
+DETECT_WIDTH = 640        # full frames are down-scaled to this width for detection (0 = full resolution)
+
+
+_vision_lock = threading.Lock()
+vision_import_seconds = None  # time load_vision_modules() spent importing
+
+
+def load_vision_modules():
+    """
+    Imports cv2 and mediapipe on first use. Safe to call from any thread; later calls return at once.
+    """
+    global cv2, mp, mp_face_mesh, vision_import_seconds
+    with _vision_lock:
+        if mp_face_mesh is not None:
+            return
+        started = time.perf_counter()
+        import cv2
+        import mediapipe as mp
+        mp_face_mesh = mp.solutions.face_mesh
+        vision_import_seconds = time.perf_counter() - started
+
+
+class FaceTracker:
+    """
+    FaceMesh with region-of-interest tracking. Once a face is found, FaceMesh only sees a square crop
+    around the previous bounding box of all faces, scaled to `roi_size` x `roi_size`. The full frame
+    (down-scaled to `detect_width`) is searched again as soon as the faces are lost, and every
+    `redetect_interval` frames so a second person stepping in is still picked up.
+    Landmarks always come out normalised to the full frame. Colour conversion and resizing
+    write into preallocated buffers. With tracking=False every frame is a full-frame search.
+    """
+
+    def __init__(self, tracking=True, roi_size=ROI_SIZE, roi_margin=ROI_MARGIN,
+                 redetect_interval=REDETECT_INTERVAL, detect_width=DETECT_WIDTH):
+        self.tracking = tracking
+        self.roi_size = roi_size
+        self.roi_margin = roi_margin
+        self.redetect_interval = max(1, redetect_interval)
+        self.detect_width = detect_width
+        self.roi = None  # (x0, y0, side) of the next crop in frame pixels; None = search the full frame
+        self.used_roi = None  # crop the last result came from (None = full frame)
+        self._frames_since_detect = 0
+        self._buffers = {}
+        self._detect_mesh = create_face_mesh()
+        # A separate graph for the crops, so FaceMesh's own frame-to-frame tracking
+        # never mixes crop and full-frame coordinates
+        self._roi_mesh = create_face_mesh() if tracking else None
+
+    def process(self, frame):
+        """
+        Returns the (faces x 478 x 3) landmarks for a BGR frame, normalised to the full frame.
+        """
+        if self.roi is not None and self._frames_since_detect < self.redetect_interval:
+            self._frames_since_detect += 1
+            landmarks = self._process_roi(frame)
+            if len(landmarks):
+                self.used_roi = self.roi
+                self._update_roi(landmarks, frame.shape)
+                return landmarks
+            # Lost the face: search the full frame right away instead of waiting for the next one
+
+        landmarks = self._process_full(frame)
+        self.used_roi = None
+        self._frames_since_detect = 0
+        if self.tracking:
+            if len(landmarks):
+                self._update_roi(landmarks, frame.shape)
+            else:
+                self.roi = None
+        return landmarks
+
+    def close(self):
+        self._detect_mesh.close()
+        if self._roi_mesh is not None:
+            self._roi_mesh.close()
+
+    def _buffer(self, name, shape):
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape:
+            buffer = self._buffers[name] = np.empty(shape, dtype=np.uint8)
+        return buffer
+
+    def _to_rgb(self, name, image):
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=self._buffer(name, image.shape))
+
+    def _process_full(self, frame):
+        img_h, img_w, _ = frame.shape
+        image = frame
+        if self.detect_width and img_w > self.detect_width:
+            height = round(img_h * self.detect_width / img_w)
+            image = cv2.resize(frame, (self.detect_width, height), dst=self._buffer("detect", (height, self.detect_width, 3)),
+                               interpolation=cv2.INTER_AREA)
+        # Normalised landmarks do not depend on the input scale
+        return run_face_mesh(self._detect_mesh, self._to_rgb("detect_rgb", image))
+
+    def _process_roi(self, frame):
+        img_h, img_w, _ = frame.shape
+        x0, y0, side = self.roi
+        crop = frame[y0:y0 + side, x0:x0 + side]
+        size = self.roi_size
+        image = cv2.resize(crop, (size, size), dst=self._buffer("roi", (size, size, 3)),
+                           interpolation=cv2.INTER_AREA if side > size else cv2.INTER_LINEAR)
+        landmarks = run_face_mesh(self._roi_mesh, self._to_rgb("roi_rgb", image))
+
+        # Crop-normalised -> frame-normalised (MediaPipe scales z like x)
+        landmarks *= np.array([side / img_w, side / img_h, side / img_w], dtype=np.float32)
+        landmarks[:, :, 0] += x0 / img_w
+        landmarks[:, :, 1] += y0 / img_h
+        return landmarks
+
+    def _update_roi(self, landmarks, shape):
+        img_h, img_w, _ = shape
+        xy = landmarks[:, :, :2].reshape(-1, 2) * np.array([img_w, img_h], dtype=np.float32)
+        (x_min, y_min), (x_max, y_max) = xy.min(axis=0), xy.max(axis=0)
+        side = max(x_max - x_min, y_max - y_min) * (1 + 2 * self.roi_margin)
+        side = int(min(max(side, ROI_MIN_SIDE), img_w, img_h))
+        # Keep the whole square inside the frame (shift rather than clip, so the crop stays square)
+        x0 = int(min(max((x_min + x_max - side) / 2, 0), img_w - side))
+        y0 = int(min(max((y_min + y_max - side) / 2, 0), img_h - side))
+        self.roi = (x0, y0, side)
+
+
+def create_face_mesh():
+    load_vision_modules()
+    return mp_face_mesh.FaceMesh(
+        max_num_faces=2,
+        refine_landmarks=True,
+        min_detection_confidence=0.5,
+        min_tracking_confidence=0.5
+    )
+
+
+def run_face_mesh(face_mesh, frame_rgb):
+    """
+    Runs FaceMesh on an RGB image; returns the (faces x 478 x 3) landmarks normalised to that image.
+    """
+    results = face_mesh.process(frame_rgb)
+    return landmarks_to_array(results.multi_face_landmarks or [])
+
+
+def landmarks_to_array(faces):
+    """
+    Copies MediaPipe landmark lists into one (faces x 478 x 3) float32 array of
+    normalised (x, y, z) coordinates. Most of the time goes into reading the protobuf
+    fields (about 1400 attribute reads per face), not into building the array.
+    """
+    landmarks = np.empty((len(faces), NUM_LANDMARKS, 3), dtype=np.float32)
+    for i, face_landmarks in enumerate(faces):
+        landmarks[i] = np.array([(lm.x, lm.y, lm.z) for lm in face_landmarks.landmark], np.float32)
+    return landmarks
+
+
+def head_pose(landmarks, img_w, img_h):
+    """
+    Vectorised head pose for every face. Returns (yaw_ratio, pitch_deg, roll_deg), each of shape (faces,).
+
+    yaw_ratio: horizontal nose offset from the inner eye corners, divided by the eye distance
+               (positive = looking right, compared against perception.yaw_ratio_threshold).
+    pitch_deg: tilt of the chin->forehead axis towards the camera (positive = head tilted back).
+    roll_deg:  angle of the line between the inner eye corners (positive = clockwise in the image).
+    """
+    # MediaPipe z uses roughly the same scale as x, so scale both by the frame width
+    points = landmarks * np.array([img_w, img_h, img_w], dtype=np.float32)
+
+    left_eye = points[:, LEFT_EYE_INNER]
+    right_eye = points[:, RIGHT_EYE_INNER]
+    eye_width = right_eye[:, 0] - left_eye[:, 0]
+    dx = points[:, NOSE_TIP, 0] - (left_eye[:, 0] + right_eye[:, 0]) / 2
+    yaw_ratio = np.divide(dx, eye_width, out=np.zeros_like(dx), where=eye_width != 0)
+
+    vertical = points[:, FOREHEAD] - points[:, CHIN]
+    pitch_deg = np.degrees(np.arctan2(vertical[:, 2], -vertical[:, 1]))
+
+    eye_line = right_eye - left_eye
+    roll_deg = np.degrees(np.arctan2(eye_line[:, 1], eye_line[:, 0]))
+
+    return yaw_ratio, pitch_deg, roll_deg
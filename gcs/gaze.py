@@ -0,0 +1,285 @@
+"""
+Eye-gaze estimation in a separate process (see GazeEstimator): the shared-memory frame ring the
+capture thread writes, the process entry point (gaze_process_main), and the iris-based gaze math
+that runs there. perception.py merges the results into faceDetection (merge_gaze).
+"""
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from facemesh import FaceTracker, head_pose
+
+log = logging.getLogger("perception.gaze")
+
+# Eye landmarks for gaze, named by image side like the head-pose indices in facemesh.py:
+# (image-left corner, image-right corner, iris centre, upper lid, lower lid)
+LEFT_EYE = (33, 133, 468, 159, 145)
+RIGHT_EYE = (362, 263, 473, 386, 374)
+
+# Eye-gaze estimation in a separate process (see GazeEstimator)
+GAZE_MAX_FPS = 15.0                 # frames per second analysed by the gaze process
+GAZE_IDLE_INTERVAL = 0.25           # seconds between attempts while no face is visible
+GAZE_POLL_INTERVAL = 0.005          # seconds between checks of the frame ring for a new frame
+GAZE_RING_SLOTS = 3                 # frames in the shared-memory ring
+GAZE_MAX_AGE = 0.5                  # seconds; older gaze results are not merged into faceDetection
+GAZE_HORIZONTAL_THRESHOLD = 0.35    # |gazeX| beyond which the gaze is "Looking Left" / "Looking Right"
+GAZE_CARD_ZONE_THRESHOLD = 0.5      # gazeY beyond which the participant is looking down at the cards
+GAZE_IRIS_GAIN = 1.0                # weight of the iris offset relative to the head yaw ratio
+GAZE_PITCH_SCALE = 30.0             # degrees of downward head pitch that count as 1.0 in gazeY
+
+# Wall-clock offset of time.perf_counter(), for the epoch-ms timestamps in faceDetection
+_PERF_TO_EPOCH = time.time() - time.perf_counter()
+
+
+class SharedFrameRing:
+    """
+    Ring of camera frames in shared memory, written by the capture thread and read by other processes.
+    Each slot carries its own sequence number (-1 while being written), so a reader can tell when a
+    slot was overwritten while it copied it and discard that copy without any lock.
+    Layout: int64 [latest seq, slot seqs...], float64 [slot capture times...], uint8 frames.
+    """
+
+    def __init__(self, shm, shape, slots):
+        self.shm = shm
+        self.shape = tuple(shape)
+        self.slots = slots
+        header = np.ndarray((1 + slots,), dtype=np.int64, buffer=shm.buf)
+        self._latest = header[:1]
+        self._slot_seqs = header[1:]
+        self._captured_at = np.ndarray((slots,), dtype=np.float64, buffer=shm.buf, offset=header.nbytes)
+        self._frames = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=shm.buf,
+                                  offset=header.nbytes + self._captured_at.nbytes)
+        self._seq = 0
+
+    @classmethod
+    def create(cls, shape, slots=GAZE_RING_SLOTS):
+        size = (1 + slots) * 8 + slots * 8 + slots * int(np.prod(shape))
+        ring = cls(shared_memory.SharedMemory(create=True, size=size), shape, slots)
+        ring._latest[0] = 0
+        ring._slot_seqs[:] = 0
+        return ring
+
+    @classmethod
+    def attach(cls, name, shape, slots):
+        return cls(shared_memory.SharedMemory(name=name), shape, slots)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, frame, captured_at):
+        seq = self._seq + 1
+        slot = seq % self.slots
+        self._slot_seqs[slot] = -1
+        np.copyto(self._frames[slot], frame)
+        self._captured_at[slot] = captured_at
+        self._slot_seqs[slot] = seq
+        self._latest[0] = seq
+        self._seq = seq
+
+    def read_latest(self, after_seq, out):
+        """
+        Copies the newest frame into `out` if it is newer than `after_seq`.
+        Returns (seq, captured_at), or None if there is no new frame (or it was overwritten mid-copy).
+        """
+        seq = int(self._latest[0])
+        if seq <= after_seq:
+            return None
+        slot = seq % self.slots
+        if self._slot_seqs[slot] != seq:
+            return None
+        np.copyto(out, self._frames[slot])
+        captured_at = float(self._captured_at[slot])
+        if self._slot_seqs[slot] != seq:
+            return None
+        return seq, captured_at
+
+    def close(self):
+        # Drop the numpy views first; SharedMemory.close() fails while buffers are exported
+        self._latest = self._slot_seqs = self._captured_at = self._frames = None
+        self.shm.close()
+
+
+class GazeEstimator:
+    """
+    Runs the iris-based gaze estimate (see estimate_gaze) in a separate process, so it neither
+    lowers the head-pose frame rate nor competes for the GIL. The capture thread copies every frame
+    into a SharedFrameRing (publish_frame); the gaze process analyses the newest one whenever it is
+    free, at most `max_fps` per second. Results come back over a queue; latest() returns the newest
+    as (captured_at, result). The process starts with the first frame, once the frame size is known.
+    """
+
+    def __init__(self, max_fps=GAZE_MAX_FPS, slots=GAZE_RING_SLOTS):
+        self.max_fps = max_fps
+        self.slots = slots
+        self._latest = None
+        self._lock = threading.Lock()  # guards the ring against stop() while the capture thread writes
+        self._ring = None
+        self._process = None
+        self._results = None
+        self._stop_event = None
+        self._receiver = None
+        self._stopped = False
+
+    def publish_frame(self, frame, captured_at):
+        with self._lock:
+            if self._stopped:
+                return
+            if self._ring is None:
+                self._start(frame.shape)
+            if frame.shape == self._ring.shape:
+                self._ring.write(frame, captured_at)
+
+    def latest(self):
+        return self._latest
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+        if self._process is None:
+            return
+        self._stop_event.set()
+        self._process.join(timeout=2.0)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+        self._receiver.join()
+        self._ring.close()
+        self._ring.shm.unlink()
+        log.info("Gaze estimator stopped.")
+
+    def _start(self, shape):
+        # 'spawn': forking a process that already runs camera and inference threads is unsafe
+        context = multiprocessing.get_context("spawn")
+        self._ring = SharedFrameRing.create(shape, self.slots)
+        self._results = context.Queue(maxsize=8)
+        self._stop_event = context.Event()
+        self._process = context.Process(
+            target=gaze_process_main, name="GazeEstimator", daemon=True,
+            args=(self._ring.name, shape, self.slots, self.max_fps, self._results, self._stop_event))
+        self._process.start()
+        self._receiver = threading.Thread(target=self._receive, name="GazeReceiver", daemon=True)
+        self._receiver.start()
+        log.info("Gaze estimator started (pid %d, %dx%d frames, max %.0f FPS)",
+                 self._process.pid, shape[1], shape[0], self.max_fps)
+
+    def _receive(self):
+        while not self._stop_event.is_set():
+            try:
+                self._latest = self._results.get(timeout=0.5)
+            except queue.Empty:
+                if not self._process.is_alive() and not self._stop_event.is_set():
+                    log.error("Gaze estimator process exited (code %s).", self._process.exitcode)
+                    return
+
+
+def gaze_process_main(ring_name, shape, slots, max_fps, results, stop_event):
+    """
+    Entry point of the gaze process: analyses the newest frame from the shared ring and puts
+    (captured_at, result) on `results`. result is the estimate_gaze dict, or None without a face.
+    """
+    ring = SharedFrameRing.attach(ring_name, shape, slots)
+    tracker = FaceTracker()
+    frame = np.empty(shape, dtype=np.uint8)
+    img_h, img_w = shape[0], shape[1]
+    min_interval = 1.0 / max_fps if max_fps > 0 else 0.0
+    last_seq = 0
+    try:
+        while not stop_event.is_set():
+            item = ring.read_latest(last_seq, frame)
+            if item is None:
+                time.sleep(GAZE_POLL_INTERVAL)
+                continue
+            started = time.perf_counter()
+            last_seq, captured_at = item
+            result = estimate_gaze(tracker.process(frame), img_w, img_h)
+            try:
+                results.put_nowait((captured_at, result))
+            except queue.Full:
+                pass  # the main process is behind; it only ever uses the newest result anyway
+            interval = min_interval if result is not None else max(min_interval, GAZE_IDLE_INTERVAL)
+            stop_event.wait(max(0.0, interval - (time.perf_counter() - started)))
+    finally:
+        tracker.close()
+        ring.close()
+
+
+def epoch_ms(perf_time):
+    """
+    time.perf_counter() value -> Unix time in milliseconds (like JavaScript's Date.now()).
+    """
+    return round((perf_time + _PERF_TO_EPOCH) * 1000)
+
+
+def eye_ratios(points, eye):
+    """
+    Iris position within one eye for every face: (horizontal, vertical), each of shape (faces,).
+    horizontal: 0 at the image-left corner, 1 at the image-right corner; vertical: 0 at the upper lid, 1 at the lower.
+    """
+    left, right, iris, upper, lower = eye
+
+    def project(start, end):
+        axis = points[:, end] - points[:, start]
+        offset = points[:, iris] - points[:, start]
+        length_sq = (axis * axis).sum(axis=1)
+        return np.divide((offset * axis).sum(axis=1), length_sq, out=np.full_like(length_sq, 0.5), where=length_sq > 0)
+
+    return project(left, right), project(upper, lower)
+
+
+def classify_gaze(gaze_x, gaze_y):
+    if gaze_y > GAZE_CARD_ZONE_THRESHOLD:
+        return "Looking At Cards"
+    if gaze_x > GAZE_HORIZONTAL_THRESHOLD:
+        return "Looking Right"
+    if gaze_x < -GAZE_HORIZONTAL_THRESHOLD:
+        return "Looking Left"
+    return "Looking Forward"
+
+
+def estimate_gaze(landmarks, img_w, img_h):
+    """
+    Eye-gaze estimate for the first face from the iris landmarks (refine_landmarks=True), or None without a face.
+    gazeX: head yaw ratio plus the iris offset from the eye centre (-1..1 per eye, averaged), positive = right.
+    gazeY: iris offset towards the lower lid plus downward head pitch (GAZE_PITCH_SCALE degrees = 1.0),
+           positive = down, towards the cards.
+    """
+    if not len(landmarks):
+        return None
+    points = landmarks[:, :, :2] * np.array([img_w, img_h], dtype=np.float32)
+    left_x, left_y = eye_ratios(points, LEFT_EYE)
+    right_x, right_y = eye_ratios(points, RIGHT_EYE)
+    iris_x = float((left_x[0] + right_x[0]) - 1.0)           # (mean - 0.5) * 2
+    iris_y = float((left_y[0] + right_y[0]) - 1.0)
+    yaw_ratios, pitches, _ = head_pose(landmarks[:1], img_w, img_h)
+
+    gaze_x = float(yaw_ratios[0]) + GAZE_IRIS_GAIN * iris_x
+    gaze_y = iris_y - float(pitches[0]) / GAZE_PITCH_SCALE
+    return {
+        "gazeDirection": classify_gaze(gaze_x, gaze_y),
+        "gazeX": gaze_x,
+        "gazeY": gaze_y,
+        "irisX": iris_x,
+        "irisY": iris_y,
+    }
+
+
+GAZE_MESSAGE_KEYS = ("gazeDirection", "gazeX", "gazeY", "irisX", "irisY")
+
+
+def merge_gaze(message, latest, captured_at):
+    """
+    Adds the newest gaze result to a faceDetection message, with its own capture timestamp.
+    Results older than GAZE_MAX_AGE (relative to the head-pose frame) are left out (fields None).
+    """
+    gaze_captured_at, result = latest if latest is not None else (None, None)
+    if gaze_captured_at is None or captured_at - gaze_captured_at > GAZE_MAX_AGE:
+        result = None
+    for key in GAZE_MESSAGE_KEYS:
+        message[key] = result[key] if result is not None else None
+    message["timestamps"]["gaze"] = epoch_ms(gaze_captured_at) if result is not None else None
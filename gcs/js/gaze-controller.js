@@ -18,7 +18,9 @@ const context = {
     faceY: 0.5,
     secondFaceX: null,
     secondFaceY: null,
-    headDirection: "none" // Updated by messaging.js
+    headDirection: "none", // Updated by messaging.js
+    gazeDirection: "none", // Eye gaze: "Looking Left" / "Looking Right" / "Looking At Cards" / "Looking Forward"
+    timestamps: {}         // Capture time (ms since epoch) of the frame behind each model's output: headPose, gaze
 };
 
 // --- Behavior Control State ---
@@ -219,6 +221,7 @@ function handleCardRevealed(data) {
     const robotMoveMessage = {
         action: "logEvent", // Or your expected action for server.py
         event: "RobotsMove",
+        participant: data.participant, // Lets the server match this to the right participant's turn
         cardId: data.cardId,
         gazeDecision: gazeDecisionForLog, // 'left', 'right', or 'none'
         // Use updated robotCondition variable, ensuring Carl takes precedence
@@ -10,6 +10,10 @@
 // --- Configuration ---
 const PERCEPTION_WS_URL = 'ws://localhost:8766';
 const LOGGING_WS_URL = 'ws://localhost:8765';
+// Server-side topics this GCS wants forwarded. An optional ?participant=... in the page URL
+// restricts forwarding to that participant (needed when several stations share one server).
+const LOGGING_TOPICS = ['cardReveal', 'startRound'];
+const STATION_PARTICIPANT = new URLSearchParams(window.location.search).get('participant');
 
 // --- State ---
 let perceptionWs = null;
@@ -20,15 +24,18 @@ let loggingMessageQueue = [];
 
 function connectPerceptionWebSocket() {
     console.log("Attempting to connect Perception WebSocket to:", PERCEPTION_WS_URL);
-    perceptionWs = new WebSocket(PERCEPTION_WS_URL);
+    // Offer the compact struct frames (wire.js); the server may still answer in JSON
+    perceptionWs = USE_BINARY_WIRE ? new WebSocket(PERCEPTION_WS_URL, [FACE_DETECTION_PROTOCOL])
+                                   : new WebSocket(PERCEPTION_WS_URL);
+    perceptionWs.binaryType = 'arraybuffer';
 
     perceptionWs.onopen = () => {
-        console.log("Perception WebSocket connected (8766).");
+        console.log(`Perception WebSocket connected (8766, ${perceptionWs.protocol || 'JSON'}).`);
     };
 
     perceptionWs.onmessage = (message) => {
         try {
-            const data = JSON.parse(message.data);
+            const data = typeof message.data === 'string' ? JSON.parse(message.data) : decodeFaceDetection(message.data);
             // console.log("[Perception WS] Received:", data); // Verbose
 
             // --- Update Shared Context ---
@@ -40,6 +47,12 @@ function connectPerceptionWebSocket() {
                 context.secondFaceX = (data.secondFaceX !== undefined && data.secondFaceX !== null) ? data.secondFaceX : null;
                 context.secondFaceY = (data.secondFaceY !== undefined && data.secondFaceY !== null) ? data.secondFaceY : null;
                 context.headDirection = (data.headDirection !== undefined && data.headDirection !== null) ? data.headDirection : "none";
+                // Eye gaze (only sent when perception.py runs with --gaze); "none" when unknown or stale
+                context.gazeDirection = (data.gazeDirection !== undefined && data.gazeDirection !== null) ? data.gazeDirection : "none";
+                context.timestamps = data.timestamps || {};
+            } else if (data.event === 'perceptionStatus') {
+                // Sent on connect and once the camera and model are warmed up (startup timings in ms)
+                console.log(`Perception node ${data.ready ? 'ready' : 'warming up'}.`, data.timings_ms);
             }
             // No longer handling 'cardReveal' here
 
@@ -64,10 +77,15 @@ function connectPerceptionWebSocket() {
 
 function connectLoggingWebSocket() {
     console.log("Attempting to connect Logging WebSocket to:", LOGGING_WS_URL);
-    loggingWs = new WebSocket(LOGGING_WS_URL);
+    // Offer msgpack frames (wire.js); the server falls back to JSON if it cannot use them
+    loggingWs = USE_BINARY_WIRE ? new WebSocket(LOGGING_WS_URL, [EVENTS_PROTOCOL]) : new WebSocket(LOGGING_WS_URL);
+    loggingWs.binaryType = 'arraybuffer';
 
     loggingWs.onopen = () => {
-        console.log("Logging WebSocket connected (8765).");
+        console.log(`Logging WebSocket connected (8765, ${loggingWs.protocol || 'JSON'}).`);
+        const subscription = { event: "subscribe", topics: LOGGING_TOPICS };
+        if (STATION_PARTICIPANT) subscription.participant = STATION_PARTICIPANT;
+        loggingWs.send(encodeLoggingMessage(subscription));
         // Send any queued messages
         while (loggingMessageQueue.length > 0) {
             const msg = loggingMessageQueue.shift();
@@ -79,7 +97,7 @@ function connectLoggingWebSocket() {
 
     loggingWs.onmessage = (message) => {
         try {
-            const data = JSON.parse(message.data);
+            const data = typeof message.data === 'string' ? JSON.parse(message.data) : msgpackDecode(message.data);
             console.log("[Logging WS] Received:", data);
 
             // --- Handle cardReveal events ---
@@ -202,6 +220,13 @@ function connectLoggingWebSocket() {
 } // End connectLoggingWebSocket
 
 
+/**
+ * Encodes a message for the logging socket: msgpack if that was negotiated, JSON otherwise.
+ */
+function encodeLoggingMessage(message) {
+    return loggingWs.protocol === EVENTS_PROTOCOL ? msgpackEncode(message) : JSON.stringify(message);
+}
+
 /**
  * Sends a message object via the Logging WebSocket connection (8765).
  * Queues the message if the connection is not yet open.
@@ -210,7 +235,7 @@ function connectLoggingWebSocket() {
 function sendGCSLogMessage(message) {
     if (loggingWs && loggingWs.readyState === WebSocket.OPEN) {
         try {
-           loggingWs.send(JSON.stringify(message));
+           loggingWs.send(encodeLoggingMessage(message));
            console.log("[Logging WS] Sent: ", message);
         } catch (e) {
            console.error("Error sending Logging WS message:", e, message);
@@ -0,0 +1,177 @@
+// js/wire.js
+"use strict";
+
+/************************************************************
+ * Binary wire formats (see wire.py in the repository root).
+ * - Perception (8766): faceDetection as a fixed 64-byte little-endian struct,
+ *   negotiated with the FACE_DETECTION_PROTOCOL subprotocol.
+ * - Logging (8765): events and replies as msgpack, negotiated with EVENTS_PROTOCOL.
+ * A server that does not support a protocol accepts the connection without it and
+ * keeps sending JSON text frames, so consumers check the type of each frame.
+ * Must be loaded before messaging.js.
+ ************************************************************/
+
+const FACE_DETECTION_PROTOCOL = 'gaze-struct.v1';
+const EVENTS_PROTOCOL = 'gaze-msgpack.v1';
+
+// Page option: ?wire=json keeps both sockets on JSON (e.g. to inspect traffic in the dev tools)
+const USE_BINARY_WIRE = new URLSearchParams(window.location.search).get('wire') !== 'json';
+
+const FACE_DETECTION_TYPE = 1;
+const FACE_DETECTION_SIZE = 64;
+const FACE_FLOAT_KEYS = ['faceX', 'faceY', 'secondFaceX', 'secondFaceY', 'headYaw', 'headPitch', 'headRoll',
+                         'gazeX', 'gazeY', 'irisX', 'irisY'];
+const DIRECTIONS = [null, 'Looking Forward', 'Looking Left', 'Looking Right', 'Looking At Cards'];
+
+/**
+ * Decodes a faceDetection struct frame into the same object the JSON frames carry.
+ * @param {ArrayBuffer} buffer
+ */
+function decodeFaceDetection(buffer) {
+    const view = new DataView(buffer);
+    if (buffer.byteLength !== FACE_DETECTION_SIZE || view.getUint8(0) !== FACE_DETECTION_TYPE) {
+        throw new Error(`Not a faceDetection frame (${buffer.byteLength} bytes)`);
+    }
+    const message = {
+        event: 'faceDetection',
+        userInFront: (view.getUint8(1) & 1) === 1,
+        headDirection: DIRECTIONS[view.getUint8(2)],
+        gazeDirection: DIRECTIONS[view.getUint8(3)],
+    };
+    let offset = 4;
+    for (const key of FACE_FLOAT_KEYS) {
+        const value = view.getFloat32(offset, true);
+        message[key] = Number.isNaN(value) ? null : value;
+        offset += 4;
+    }
+    const headPose = view.getFloat64(offset, true);
+    const gaze = view.getFloat64(offset + 8, true);
+    message.timestamps = {
+        headPose: Number.isNaN(headPose) ? null : headPose,
+        gaze: Number.isNaN(gaze) ? null : gaze,
+    };
+    return message;
+}
+
+// --- Minimal msgpack (nil, bool, int, float, str, bin, array, map) ---
+
+const textEncoder = new TextEncoder();
+const textDecoder = new TextDecoder();
+
+/**
+ * Encodes a plain object as msgpack.
+ * @returns {Uint8Array}
+ */
+function msgpackEncode(value) {
+    let buffer = new Uint8Array(256);
+    let view = new DataView(buffer.buffer);
+    let length = 0;
+
+    function reserve(n) {
+        if (length + n <= buffer.length) return;
+        const grown = new Uint8Array(Math.max(buffer.length * 2, length + n));
+        grown.set(buffer);
+        buffer = grown;
+        view = new DataView(buffer.buffer);
+    }
+    function byte(b) { reserve(1); buffer[length++] = b; }
+    function header(fixBase, fixMax, code8, code16, code32, n) {
+        if (n <= fixMax && fixBase !== null) { byte(fixBase | n); }
+        else if (n < 0x100 && code8 !== null) { byte(code8); byte(n); }
+        else if (n < 0x10000) { byte(code16); reserve(2); view.setUint16(length, n); length += 2; }
+        else { byte(code32); reserve(4); view.setUint32(length, n); length += 4; }
+    }
+    function write(v) {
+        if (v === null || v === undefined) { byte(0xc0); }
+        else if (v === false) { byte(0xc2); }
+        else if (v === true) { byte(0xc3); }
+        else if (typeof v === 'number') {
+            if (!Number.isSafeInteger(v)) { byte(0xcb); reserve(8); view.setFloat64(length, v); length += 8; }
+            else if (v >= 0 && v < 0x80) { byte(v); }
+            else if (v < 0 && v >= -32) { byte(v & 0xff); }
+            else if (v >= 0 && v < 0x100) { byte(0xcc); byte(v); }
+            else if (v >= 0 && v < 0x10000) { byte(0xcd); reserve(2); view.setUint16(length, v); length += 2; }
+            else if (v >= 0 && v < 0x100000000) { byte(0xce); reserve(4); view.setUint32(length, v); length += 4; }
+            else if (v >= -0x80000000 && v < 0) { byte(0xd2); reserve(4); view.setInt32(length, v); length += 4; }
+            else { byte(0xd3); reserve(8); view.setBigInt64(length, BigInt(v)); length += 8; }  // e.g. Date.now()
+        }
+        else if (typeof v === 'string') {
+            const bytes = textEncoder.encode(v);
+            header(0xa0, 31, 0xd9, 0xda, 0xdb, bytes.length);
+            reserve(bytes.length); buffer.set(bytes, length); length += bytes.length;
+        }
+        else if (v instanceof Uint8Array) {
+            header(null, -1, 0xc4, 0xc5, 0xc6, v.length);
+            reserve(v.length); buffer.set(v, length); length += v.length;
+        }
+        else if (Array.isArray(v)) {
+            header(0x90, 15, null, 0xdc, 0xdd, v.length);
+            v.forEach(write);
+        }
+        else if (typeof v === 'object') {
+            const keys = Object.keys(v).filter(k => v[k] !== undefined);
+            header(0x80, 15, null, 0xde, 0xdf, keys.length);
+            for (const k of keys) { write(k); write(v[k]); }
+        }
+        else { throw new Error(`msgpackEncode: unsupported type ${typeof v}`); }
+    }
+
+    write(value);
+    return buffer.subarray(0, length);
+}
+
+/**
+ * Decodes one msgpack value.
+ * @param {ArrayBuffer|Uint8Array} data
+ */
+function msgpackDecode(data) {
+    const bytes = data instanceof Uint8Array ? data : new Uint8Array(data);
+    const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+    let offset = 0;
+
+    function str(n) { const s = textDecoder.decode(bytes.subarray(offset, offset + n)); offset += n; return s; }
+    function bin(n) { const b = bytes.slice(offset, offset + n); offset += n; return b; }
+    function array(n) { const a = new Array(n); for (let i = 0; i < n; i++) a[i] = read(); return a; }
+    function map(n) { const m = {}; for (let i = 0; i < n; i++) { const k = read(); m[k] = read(); } return m; }
+    function u8() { return view.getUint8(offset++); }
+    function u16() { const v = view.getUint16(offset); offset += 2; return v; }
+    function u32() { const v = view.getUint32(offset); offset += 4; return v; }
+
+    function read() {
+        const b = u8();
+        if (b < 0x80) return b;
+        if (b < 0x90) return map(b & 0x0f);
+        if (b < 0xa0) return array(b & 0x0f);
+        if (b < 0xc0) return str(b & 0x1f);
+        if (b >= 0xe0) return b - 0x100;
+        let v;
+        switch (b) {
+            case 0xc0: return null;
+            case 0xc2: return false;
+            case 0xc3: return true;
+            case 0xc4: return bin(u8());
+            case 0xc5: return bin(u16());
+            case 0xc6: return bin(u32());
+            case 0xca: v = view.getFloat32(offset); offset += 4; return v;
+            case 0xcb: v = view.getFloat64(offset); offset += 8; return v;
+            case 0xcc: return u8();
+            case 0xcd: return u16();
+            case 0xce: return u32();
+            case 0xcf: v = Number(view.getBigUint64(offset)); offset += 8; return v;
+            case 0xd0: v = view.getInt8(offset); offset += 1; return v;
+            case 0xd1: v = view.getInt16(offset); offset += 2; return v;
+            case 0xd2: v = view.getInt32(offset); offset += 4; return v;
+            case 0xd3: v = Number(view.getBigInt64(offset)); offset += 8; return v;
+            case 0xd9: return str(u8());
+            case 0xda: return str(u16());
+            case 0xdb: return str(u32());
+            case 0xdc: return array(u16());
+            case 0xdd: return array(u32());
+            case 0xde: return map(u16());
+            case 0xdf: return map(u32());
+            default: throw new Error(`msgpackDecode: unsupported type byte 0x${b.toString(16)}`);
+        }
+    }
+
+    return read();
+}
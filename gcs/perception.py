@@ -1,134 +1,851 @@
+import argparse
 import asyncio
+import collections
+import functools
 import json
-import cv2
-import mediapipe as mp
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+import numpy as np
 import websockets
 
-# Initialize MediaPipe FaceMesh
-mp_face_mesh = mp.solutions.face_mesh
-mp_drawing = mp.solutions.drawing_utils
-drawing_spec = mp_drawing.DrawingSpec(thickness=1, circle_radius=1)
+# Reference point of the startup timings (see PerceptionEngine.timings)
+_MODULE_LOADED = time.perf_counter()
+
+# cv2 and mediapipe take about a second to import, so they are not imported here but by
+# load_vision_modules(): after the WebSocket server is listening (see main), or by the first
+# FaceTracker / FrameCapture that needs them (e.g. in gcs/replay.py and the gaze process)
+cv2 = None
+mp = None
+
+# logsetup.py is shared with server.py at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import logsetup
+import wire
+
+import facemesh
+from facemesh import DETECT_WIDTH, REDETECT_INTERVAL, ROI_SIZE, FaceTracker, head_pose
+from gaze import GAZE_MAX_FPS, GazeEstimator, epoch_ms, merge_gaze
+
+log = logging.getLogger("perception")
+
+# Per-second frame counts (inferred, face / no face, skipped, published) instead of per-frame log lines
+frame_summary = logsetup.EventSummary(log, "Frames", level=logging.DEBUG)
+
+# Debug overlay: the face mesh tessellation as (edges x 2) landmark index pairs, drawn with cv2.polylines
+# (set by load_vision_modules())
+TESSELATION_EDGES = None
+TESSELATION_COLOR = (224, 224, 224)
+ROI_COLOR = (0, 200, 0)
 
 # Define a yaw ratio threshold for head direction detection
 yaw_ratio_threshold = 0.2
 
+# How often (in seconds) the pipeline logs its latency / FPS summary
+STATS_INTERVAL = 5.0
+
+# Structured log (JSON lines, see logsetup.py), next to the human-readable console output
+JSON_LOG_FILENAME = "perception_log.jsonl"
+
+# Results buffered per subscriber; older ones are dropped so a slow client never lags behind
+SUBSCRIBER_QUEUE_SIZE = 2
+
+# Defaults for the 'delta' publish mode (see PublishFilter)
+POSITION_EPSILON = 0.02   # minimum face movement (normalised coords) that triggers a send
+HEARTBEAT_INTERVAL = 1.0  # seconds; resend the current state at least this often
+
+# While nobody is in front of the camera, inference runs only on every n-th frame.
+# The stride doubles with every empty frame up to this maximum and resets once a face is found.
+IDLE_MAX_STRIDE = 8
 
-async def face_detection_server(websocket, path=None):  # ✅ FIX: Added `path=None`
+# Startup: FaceMesh runs this many times on a synthetic frame before the first camera frame,
+# so the first real frame does not pay for the model's first-run allocations
+WARM_UP_INFERENCES = 3
+WARM_UP_FRAME_SIZE = (640, 480)  # (width, height)
+
+# One JSON line per start with the cold-start timings (see PerceptionEngine.timings)
+STARTUP_LOG_FILENAME = "perception_startup.jsonl"
+
+# Debug preview stream (MJPEG over HTTP), rendered only while someone is watching
+PREVIEW_FPS = 5.0
+PREVIEW_JPEG_QUALITY = 70
+
+
+def load_vision_modules():
     """
-    WebSocket server function for real-time face detection using OpenCV and MediaPipe.
+    facemesh.load_vision_modules(), then binds this module's cv2 / mp and the overlay tessellation.
+    Safe to call from any thread; later calls return at once.
+    """
+    global cv2, mp, TESSELATION_EDGES
+    facemesh.load_vision_modules()
+    if TESSELATION_EDGES is None:
+        cv2, mp = facemesh.cv2, facemesh.mp
+        TESSELATION_EDGES = np.array(sorted(facemesh.mp_face_mesh.FACEMESH_TESSELATION), dtype=np.int32)
+
+
+class FrameCapture(threading.Thread):
+    """
+    Reads frames from the webcam on a dedicated thread.
+    Only the newest frame is kept, so a slow consumer never works on stale images.
+    `open_seconds` is the time from opening the camera to the first frame.
+    """
+
+    def __init__(self, device=0, on_frame=None):
+        super().__init__(name="FrameCapture", daemon=True)
+        self.device = device
+        self.on_frame = on_frame  # optional callback(frame, captured_at) on the capture thread
+        self._cond = threading.Condition()
+        self._frame = None
+        self._captured_at = 0.0
+        self._seq = 0
+        self._stopped = threading.Event()
+        self.open_seconds = None
+
+    def run(self):
+        load_vision_modules()
+        started = time.perf_counter()
+        cap = cv2.VideoCapture(self.device)
+        if not cap.isOpened():
+            log.error("Could not access webcam %s.", self.device)
+            self.stop()
+            return
+
+        try:
+            while not self._stopped.is_set():
+                ret, frame = cap.read()
+                captured_at = time.perf_counter()
+                if not ret:
+                    log.warning("No frame captured from webcam. Exiting.")
+                    break
+                if self.open_seconds is None:
+                    self.open_seconds = captured_at - started
+                with self._cond:
+                    # Overwrite whatever is still waiting; the old frame is simply dropped
+                    self._frame = frame
+                    self._captured_at = captured_at
+                    self._seq += 1
+                    self._cond.notify_all()
+                if self.on_frame is not None:
+                    self.on_frame(frame, captured_at)
+        finally:
+            cap.release()
+            self.stop()
+
+    def latest(self, after_seq, timeout=None):
+        """
+        Blocks until a frame newer than `after_seq` is available.
+        Returns (seq, frame, captured_at), or None on timeout / once capture has stopped.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > after_seq or self._stopped.is_set(), timeout)
+            if self._seq <= after_seq:
+                return None
+            return self._seq, self._frame, self._captured_at
+
+    @property
+    def stopped(self):
+        return self._stopped.is_set()
+
+    def stop(self):
+        self._stopped.set()
+        with self._cond:
+            self._cond.notify_all()
+
+
+class FrameResult:
+    """
+    Output of one inference pass, handed from the inference thread to the publisher.
+    The message is encoded at most once per wire format and shared by every subscriber.
+    """
+    __slots__ = ("message", "_payload", "_packed", "captured_at", "processed_at", "debug_frame", "dropped")
+
+    def __init__(self, message, captured_at, processed_at, debug_frame, dropped):
+        self.message = message
+        self._payload = None
+        self._packed = None
+        self.captured_at = captured_at
+        self.processed_at = processed_at
+        self.debug_frame = debug_frame
+        self.dropped = dropped
+
+    @property
+    def payload(self):
+        """
+        JSON text frame.
+        """
+        if self._payload is None:
+            self._payload = json.dumps(self.message)
+        return self._payload
+
+    @property
+    def packed(self):
+        """
+        Binary struct frame (wire.FACE_DETECTION_PROTOCOL).
+        """
+        if self._packed is None:
+            self._packed = wire.encode_face_detection(self.message)
+        return self._packed
+
+
+class InferenceWorker(threading.Thread):
+    """
+    Runs FaceMesh on the newest captured frame and hands each result to `on_result`.
+    `on_result(None)` is called once when the worker stops.
+    Before the first frame it loads the model and warms it up on a synthetic frame (see warm_up),
+    recording the durations in `timings` (seconds).
+    While no face is visible, frames are skipped with a growing stride (up to `idle_max_stride`).
+    The debug overlay is only drawn when the local window is shown or a preview viewer wants a frame.
+    """
+
+    def __init__(self, capture, on_result, idle_max_stride=IDLE_MAX_STRIDE, show_window=True, preview=None,
+                 make_tracker=FaceTracker, gaze=None):
+        super().__init__(name="InferenceWorker", daemon=True)
+        self.capture = capture
+        self.make_tracker = make_tracker
+        self.gaze = gaze
+        self.on_result = on_result
+        self.idle_max_stride = max(1, idle_max_stride)
+        self.show_window = show_window
+        self.preview = preview
+        self.timings = {}
+        self._stopped = threading.Event()
+
+    def run(self):
+        # Imports first: a client may connect while main() is still importing (the worker then
+        # waits for it here), and that wait is not part of the model load
+        load_vision_modules()
+        started = time.perf_counter()
+        tracker = self.make_tracker()
+        self.timings["model_load"] = time.perf_counter() - started
+        last_seq = 0
+        stride = 1
+        try:
+            self.timings.update(warm_up(tracker))
+            while not self._stopped.is_set():
+                item = self.capture.latest(last_seq + stride - 1, timeout=0.5)
+                if item is None:
+                    if self.capture.stopped:
+                        break
+                    continue
+
+                seq, frame, captured_at = item
+                dropped = seq - last_seq - 1
+                last_seq = seq
+
+                message, landmarks = analyze_frame(tracker, frame)
+                message["timestamps"] = {"headPose": epoch_ms(captured_at)}
+                if self.gaze is not None:
+                    merge_gaze(message, self.gaze.latest(), captured_at)
+                frame_summary.count("face" if len(landmarks) else "no_face")
+                frame_summary.count("full_frame" if tracker.used_roi is None else "roi")
+                if dropped:
+                    frame_summary.count("skipped", dropped)
+                stride = 1 if len(landmarks) else min(stride * 2, self.idle_max_stride)
+
+                render_preview = self.preview is not None and self.preview.wants_frame(time.perf_counter())
+                if self.show_window or render_preview:
+                    draw_debug_overlay(frame, landmarks, message, tracker.used_roi)
+                if render_preview:
+                    self.preview.publish_threadsafe(encode_jpeg(frame))
+
+                debug_frame = frame if self.show_window else None
+                self.on_result(FrameResult(message, captured_at, time.perf_counter(), debug_frame, dropped))
+        finally:
+            tracker.close()
+            if self.gaze is not None:
+                self.gaze.stop()
+            self.on_result(None)
+
+    def stop(self):
+        self._stopped.set()
+
+
+class Subscriber:
+    """
+    Per-client queue of results (FrameResult). When `maxsize` results are waiting, the oldest one
+    is dropped. A None entry marks the end of the stream. Status messages (dict, sent as JSON,
+    see offer_status) are kept separately, never dropped, and returned before any waiting result.
+    """
+
+    def __init__(self, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        self.maxsize = maxsize
+        self.results = collections.deque()
+        self.statuses = collections.deque()
+        self.dropped = 0
+        self._available = asyncio.Event()
+
+    def offer(self, result):
+        if len(self.results) >= self.maxsize:
+            self.results.popleft()
+            self.dropped += 1
+        self.results.append(result)
+        self._available.set()
+
+    def offer_status(self, message):
+        self.statuses.append(message)
+        self._available.set()
+
+    async def get(self):
+        while not (self.statuses or self.results):
+            self._available.clear()
+            await self._available.wait()
+        return self.statuses.popleft() if self.statuses else self.results.popleft()
+
+
+class PublishFilter:
+    """
+    Decides which results are broadcast.
+    'every' sends every frame; 'delta' only sends when `headDirection`, `gazeDirection` or `userInFront`
+    changes, when a face moves more than `epsilon`, or when `heartbeat` seconds have passed.
+    """
+
+    POSITION_KEYS = (("faceX", "faceY"), ("secondFaceX", "secondFaceY"))
+
+    def __init__(self, mode="every", epsilon=POSITION_EPSILON, heartbeat=HEARTBEAT_INTERVAL):
+        self.mode = mode
+        self.epsilon = epsilon
+        self.heartbeat = heartbeat
+        self._last = None
+        self._last_sent = 0.0
+
+    def should_publish(self, message, now):
+        last = self._last
+        state_changed = (last is None
+                         or message["userInFront"] != last["userInFront"]
+                         or message["headDirection"] != last["headDirection"]
+                         or message.get("gazeDirection") != last.get("gazeDirection"))
+        if state_changed:
+            log.info("Perception state: userInFront=%s, %s, gaze %s",
+                     message["userInFront"], message["headDirection"], message.get("gazeDirection"),
+                     extra={"userInFront": message["userInFront"], "headDirection": message["headDirection"],
+                            "gazeDirection": message.get("gazeDirection")})
+
+        if self.mode == "delta" and not state_changed and not self._moved(last, message) \
+                and now - self._last_sent < self.heartbeat:
+            return False
+
+        self._last = message
+        self._last_sent = now
+        return True
+
+    def _moved(self, last, message):
+        for x_key, y_key in self.POSITION_KEYS:
+            x0, y0, x1, y1 = last[x_key], last[y_key], message[x_key], message[y_key]
+            if (x0 is None) != (x1 is None):
+                return True
+            if x1 is not None and max(abs(x1 - x0), abs(y1 - y0)) > self.epsilon:
+                return True
+        return False
+
+
+class PreviewStream:
+    """
+    Serves the annotated debug view as an MJPEG stream (open http://host:port/ in a browser).
+    Frames are only rendered while at least one viewer is connected, at most `fps` per second.
+    """
+
+    def __init__(self, fps=PREVIEW_FPS):
+        self.interval = 1.0 / fps
+        self.viewers = 0
+        self._next_due = 0.0
+        self._jpeg = None
+        self._new_frame = None
+        self._loop = None
+        self._server = None
+        self._writers = set()
+        self._closing = False
+
+    async def start(self, host, port):
+        self._loop = asyncio.get_running_loop()
+        self._new_frame = asyncio.Event()
+        self._server = await asyncio.start_server(self._handle_viewer, host, port)
+        log.info("Debug preview stream available at http://%s:%d/", host, port)
+
+    async def close(self):
+        if self._server is not None:
+            # wait_closed() waits for open connections (Python 3.12.1+), so end the viewers first:
+            # wake the ones waiting for a frame and close every connection
+            self._closing = True
+            self._server.close()
+            self._new_frame.set()
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+
+    def wants_frame(self, now):
+        """
+        Called from the inference thread: True if a viewer is connected and the next frame is due.
+        """
+        if self.viewers == 0 or now < self._next_due:
+            return False
+        self._next_due = now + self.interval
+        return True
+
+    def publish_threadsafe(self, jpeg):
+        self._loop.call_soon_threadsafe(self._publish, jpeg)
+
+    def _publish(self, jpeg):
+        self._jpeg = jpeg
+        new_frame, self._new_frame = self._new_frame, asyncio.Event()
+        new_frame.set()
+
+    async def _handle_viewer(self, reader, writer):
+        self._writers.add(writer)
+        try:
+            await reader.readuntil(b"\r\n\r\n")  # request line + headers; every path gets the stream
+            writer.write(b"HTTP/1.1 200 OK\r\n"
+                         b"Content-Type: multipart/x-mixed-replace; boundary=frame\r\n"
+                         b"Cache-Control: no-cache\r\n"
+                         b"Connection: close\r\n\r\n")
+            self.viewers += 1
+            try:
+                while not self._closing:
+                    await self._new_frame.wait()
+                    jpeg = self._jpeg
+                    if self._closing or jpeg is None:
+                        break
+                    writer.write(b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n" % len(jpeg))
+                    writer.write(jpeg)
+                    writer.write(b"\r\n")
+                    await writer.drain()
+            finally:
+                self.viewers -= 1
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.CancelledError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+
+class PerceptionEngine:
+    """
+    Owns the camera and the FaceMesh model for the whole process and broadcasts
+    every published result to all subscribers. The pipeline starts with the first subscriber,
+    or right away with start() (--warm-start).
+    Once the first camera frame has been analysed the engine is `ready`; subscribers then get a
+    perceptionStatus message (status_message) with the startup `timings`, in ms:
+        socket_bound_at, ready_at   since the module was loaded
+        import                      cv2 + mediapipe imports
+        model_load                  FaceMesh graph construction
+        first_inference, warm_inference   first and last warm-up inference on a synthetic frame
+        camera_open                 opening the camera -> first frame
     """
-    face_mesh = mp_face_mesh.FaceMesh(
-        max_num_faces=2,
-        refine_landmarks=True,
-        min_detection_confidence=0.5,
-        min_tracking_confidence=0.5
-    )
 
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
-        print("Error: Could not access webcam.")
+    def __init__(self, device=0, publish_filter=None, idle_max_stride=IDLE_MAX_STRIDE, headless=False, preview=None,
+                 make_tracker=FaceTracker, gaze_fps=0, startup_log=None):
+        self.device = device
+        self.startup_log = startup_log  # append the timings of every start to this JSON-lines file
+        self.make_tracker = make_tracker
+        self.gaze_fps = gaze_fps  # > 0 runs the GazeEstimator process at up to this frame rate
+        self.publish_filter = publish_filter or PublishFilter()
+        self.idle_max_stride = idle_max_stride
+        self.headless = headless
+        self.preview = preview
+        self.subscribers = set()
+        self.capture = None
+        self.worker = None
+        self.last_published = None
+        self.ready = False
+        self.timings = {}
+        self._loop = None
+
+    def subscribe(self):
+        subscriber = Subscriber()
+        self.subscribers.add(subscriber)
+        if self.worker is None:
+            self._start()
+        elif self.last_published is not None:
+            # In 'delta' mode the next send may be a while away, so start from the current state
+            subscriber.offer(self.last_published)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    def start(self):
+        """
+        Opens the camera and loads the model now instead of on the first subscription.
+        """
+        if self.worker is None:
+            self._start()
+
+    def status_message(self):
+        return {"event": "perceptionStatus", "ready": self.ready, "timings_ms": dict(self.timings)}
+
+    def record_timing(self, name, seconds):
+        self.timings[name] = round(seconds * 1000, 1)
+
+    def _start(self):
+        self._loop = asyncio.get_running_loop()
+        gaze = GazeEstimator(self.gaze_fps) if self.gaze_fps > 0 else None
+        self.capture = FrameCapture(self.device, on_frame=gaze.publish_frame if gaze is not None else None)
+        self.worker = InferenceWorker(self.capture, self._on_result_threadsafe, self.idle_max_stride,
+                                      show_window=not self.headless, preview=self.preview,
+                                      make_tracker=self.make_tracker, gaze=gaze)
+        self.capture.start()
+        self.worker.start()
+        log.info("Perception engine started on camera %s", self.device)
+
+    def _stop(self):
+        if self.worker is not None:
+            self.worker.stop()
+            self.capture.stop()
+
+    def _on_result_threadsafe(self, result):
+        self._loop.call_soon_threadsafe(self._dispatch, result)
+
+    def _dispatch(self, result):
+        if result is None:
+            # Pipeline ended (camera lost, ESC or shutdown); the next subscriber restarts it
+            log.info("Perception engine stopped.")
+            self.capture = None
+            self.worker = None
+            self.last_published = None
+            self.ready = False
+            for subscriber in self.subscribers:
+                subscriber.offer(None)
+            if not self.headless:
+                cv2.destroyAllWindows()
+            return
+
+        if not self.ready:
+            self._on_ready()
+
+        if self.publish_filter.should_publish(result.message, result.processed_at):
+            frame_summary.count("published")
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("faceDetection %s", result.payload)
+            self.last_published = result
+            for subscriber in self.subscribers:
+                subscriber.offer(result)
+
+        if result.debug_frame is not None:
+            # imshow/waitKey stay on the main thread (required by some GUI backends, e.g. macOS)
+            cv2.imshow("Perception Debug View", result.debug_frame)
+            if cv2.waitKey(1) & 0xFF == 27:
+                self._stop()
+
+    def _on_ready(self):
+        self.ready = True
+        for name, seconds in self.worker.timings.items():
+            self.record_timing(name, seconds)
+        if facemesh.vision_import_seconds is not None:
+            self.record_timing("import", facemesh.vision_import_seconds)
+        if self.capture.open_seconds is not None:
+            self.record_timing("camera_open", self.capture.open_seconds)
+        self.record_timing("ready_at", time.perf_counter() - _MODULE_LOADED)
+        log.info("Perception ready %.0f ms after start (import %s ms, model load %s ms, first inference %s ms, "
+                 "camera open %s ms)", self.timings["ready_at"], self.timings.get("import"),
+                 self.timings.get("model_load"), self.timings.get("first_inference"), self.timings.get("camera_open"),
+                 extra={"startup_ms": dict(self.timings)})
+        if self.startup_log:
+            write_startup_log(self.startup_log, self.timings)
+        status = self.status_message()
+        for subscriber in self.subscribers:
+            subscriber.offer_status(status)
+
+    async def shutdown(self):
+        worker, capture = self.worker, self.capture
+        self._stop()
+        if worker is not None:
+            await self._loop.run_in_executor(None, worker.join)
+            await self._loop.run_in_executor(None, capture.join)
+        if self.preview is not None:
+            await self.preview.close()
+        if not self.headless and cv2 is not None:
+            cv2.destroyAllWindows()
+
+
+class PipelineStats:
+    """
+    Tracks end-to-end latency (capture -> sent) and achieved FPS for one subscriber,
+    printing a summary periodically.
+    """
+
+    def __init__(self, label, subscriber, interval=STATS_INTERVAL):
+        self.label = label
+        self.subscriber = subscriber
+        self.interval = interval
+        self._reset(time.perf_counter())
+
+    def _reset(self, now):
+        self.window_start = now
+        self.frames = 0
+        self.dropped = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.inference_sum = 0.0
+
+    def record(self, result, sent_at):
+        latency = sent_at - result.captured_at
+        self.frames += 1
+        self.dropped += result.dropped
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.inference_sum += result.processed_at - result.captured_at
+
+        elapsed = sent_at - self.window_start
+        if elapsed >= self.interval:
+            fps = self.frames / elapsed
+            latency_avg_ms = 1000 * self.latency_sum / self.frames
+            inference_avg_ms = 1000 * self.inference_sum / self.frames
+            latency_max_ms = 1000 * self.latency_max
+            log.info("Perception stats [%s]: %.1f FPS sent, latency avg %.1f ms (capture->inference %.1f ms), "
+                     "max %.1f ms, %d frames skipped, %d dropped from queue so far",
+                     self.label, fps, latency_avg_ms, inference_avg_ms, latency_max_ms,
+                     self.dropped, self.subscriber.dropped,
+                     extra={"client": str(self.label), "fps": round(fps, 1), "latency_avg_ms": round(latency_avg_ms, 1),
+                            "inference_avg_ms": round(inference_avg_ms, 1), "latency_max_ms": round(latency_max_ms, 1),
+                            "frames_skipped": self.dropped, "queue_dropped": self.subscriber.dropped})
+            self._reset(sent_at)
+
+
+def face_centers(landmarks):
+    """
+    Centre of each face's landmark bounding box, shape (faces x 2), normalised to the frame.
+    """
+    xy = landmarks[:, :, :2]
+    return (xy.min(axis=1) + xy.max(axis=1)) / 2
+
+
+def classify_head_direction(yaw_ratio):
+    if yaw_ratio > yaw_ratio_threshold:
+        return "Looking Right"
+    if yaw_ratio < -yaw_ratio_threshold:
+        return "Looking Left"
+    return "Looking Forward"
+
+
+def build_face_message(landmarks, img_w, img_h):
+    """
+    Builds the `faceDetection` message from a (faces x 478 x 3) landmark array.
+    """
+    face_found = len(landmarks) > 0
+
+    faceX = None
+    faceY = None
+    secondFaceX = None
+    secondFaceY = None
+    head_direction_text = "Looking Forward"
+    yaw = pitch = roll = None
+
+    if face_found:
+        centers = face_centers(landmarks)
+        faceX, faceY = float(centers[0, 0]), float(centers[0, 1])
+        if len(centers) > 1:
+            secondFaceX, secondFaceY = float(centers[1, 0]), float(centers[1, 1])
+
+        yaw_ratios, pitches, rolls = head_pose(landmarks, img_w, img_h)
+        yaw, pitch, roll = float(yaw_ratios[0]), float(pitches[0]), float(rolls[0])
+        head_direction_text = classify_head_direction(yaw)
+
+    return {
+        "event": "faceDetection",
+        "userInFront": face_found,
+        "faceX": faceX,
+        "faceY": faceY,
+        "secondFaceX": secondFaceX,
+        "secondFaceY": secondFaceY,
+        "headDirection": head_direction_text,
+        "headYaw": yaw,
+        "headPitch": pitch,
+        "headRoll": roll
+    }
+
+
+def analyze_frame(tracker, frame):
+    """
+    Runs the FaceTracker on a BGR frame and builds the `faceDetection` message.
+    Returns (message, landmarks) with landmarks normalised to the frame.
+    """
+    img_h, img_w, _ = frame.shape
+    landmarks = tracker.process(frame)
+    message = build_face_message(landmarks, img_w, img_h)
+    return message, landmarks
+
+
+def synthetic_frame(width, height):
+    """
+    Deterministic stand-in for a camera frame: a vertical gradient with a skin-toned ellipse
+    where a face would be, so the warm-up goes through the same resize/convert/detect path.
+    """
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[:] = np.linspace(40, 200, height, dtype=np.uint8)[:, None, None]
+    cv2.ellipse(frame, (width // 2, height // 2), (width // 8, height // 5), 0, 0, 360, (150, 180, 220), -1)
+    return frame
+
+
+def warm_up(tracker, inferences=WARM_UP_INFERENCES, size=WARM_UP_FRAME_SIZE):
+    """
+    Runs the model on a synthetic frame; returns the first and last inference time (seconds).
+    The first one carries the model's one-off setup cost that would otherwise hit the first client.
+    """
+    frame = synthetic_frame(*size)
+    durations = []
+    for _ in range(max(1, inferences)):
+        started = time.perf_counter()
+        analyze_frame(tracker, frame)
+        durations.append(time.perf_counter() - started)
+    return {"first_inference": durations[0], "warm_inference": durations[-1]}
+
+
+def write_startup_log(path, timings):
+    """
+    Appends one start's timings, with the library versions, to track cold-start cost across releases.
+    """
+    entry = {
+        "ts": datetime.now(timezone.utc).isoformat(),
+        "timings_ms": timings,
+        "versions": {"python": sys.version.split()[0], "opencv": cv2.__version__, "mediapipe": mp.__version__},
+    }
+    try:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+    except OSError as e:
+        log.warning("Could not write startup timings to %s: %s", path, e)
+
+
+def encode_jpeg(frame):
+    ok, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, PREVIEW_JPEG_QUALITY])
+    return buffer.tobytes() if ok else b""
+
+
+def draw_debug_overlay(frame, landmarks, message, roi=None):
+    """
+    Draws the face mesh tessellation, head direction and the tracking ROI used for this frame
+    onto the frame (in place).
+    """
+    if roi is not None:
+        x0, y0, side = roi
+        cv2.rectangle(frame, (x0, y0), (x0 + side, y0 + side), ROI_COLOR, 1)
+    if not len(landmarks):
         return
+    img_h, img_w, _ = frame.shape
+    points = np.rint(landmarks[:, :, :2] * np.array([img_w, img_h], dtype=np.float32)).astype(np.int32)
+    for face_points in points:
+        cv2.polylines(frame, face_points[TESSELATION_EDGES], False, TESSELATION_COLOR, 1)
+    text_x = int(message["faceX"] * img_w)
+    text_y = int(message["faceY"] * img_h) - 30
+    cv2.putText(frame, message["headDirection"], (text_x, text_y),
+                cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255, 0, 0), 2)
+
+
+async def face_detection_server(websocket, path=None, engine=None):  # ✅ FIX: Added `path=None`
+    """
+    WebSocket server function for real-time face detection using OpenCV and MediaPipe.
+    Subscribes the client to the shared perception engine and sends it the published results,
+    as struct frames if the client negotiated wire.FACE_DETECTION_PROTOCOL, otherwise as JSON.
+    """
+    binary = getattr(websocket, "subprotocol", None) == wire.FACE_DETECTION_PROTOCOL
+    subscriber = engine.subscribe()
+    stats = PipelineStats(websocket.remote_address, subscriber)
+    log.info("Perception client connected: %s (%d subscribed, %s)", websocket.remote_address, len(engine.subscribers),
+             "binary" if binary else "JSON")
 
     try:
+        # Status messages are always JSON text (wire.py only covers faceDetection)
+        await websocket.send(json.dumps(engine.status_message()))
         while True:
-            ret, frame = cap.read()
-            if not ret:
-                print("No frame captured from webcam. Exiting.")
-                break
-
-            img_h, img_w, _ = frame.shape
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            results = face_mesh.process(frame_rgb)
-            faces = results.multi_face_landmarks if results.multi_face_landmarks is not None else []
-            face_found = len(faces) > 0
-
-            faceX = None
-            faceY = None
-            secondFaceX = None
-            secondFaceY = None
-            head_direction_text = "Looking Forward"
-
-            if face_found:
-                face_landmarks = faces[0]
-                xs = [lm.x for lm in face_landmarks.landmark]
-                ys = [lm.y for lm in face_landmarks.landmark]
-                faceX = min(xs) + (max(xs) - min(xs)) / 2
-                faceY = min(ys) + (max(ys) - min(ys)) / 2
-
-                if len(faces) > 1:
-                    face2 = faces[1]
-                    xs2 = [lm.x for lm in face2.landmark]
-                    ys2 = [lm.y for lm in face2.landmark]
-                    secondFaceX = min(xs2) + (max(xs2) - min(xs2)) / 2
-                    secondFaceY = min(ys2) + (max(ys2) - min(ys2)) / 2
-
-                try:
-                    left_eye_inner = face_landmarks.landmark[133]
-                    right_eye_inner = face_landmarks.landmark[362]
-                    baseline_x = (left_eye_inner.x + right_eye_inner.x) / 2
-                    nose_tip = face_landmarks.landmark[1]
-                    dx = nose_tip.x - baseline_x
-                    eye_width = right_eye_inner.x - left_eye_inner.x
-                    ratio = dx / eye_width if eye_width != 0 else 0
-
-                    if ratio > yaw_ratio_threshold:
-                        head_direction_text = "Looking Right"
-                    elif ratio < -yaw_ratio_threshold:
-                        head_direction_text = "Looking Left"
-                    else:
-                        head_direction_text = "Looking Forward"
-                except Exception as e:
-                    print("Head rotation detection error:", e)
-                    head_direction_text = "Looking Forward"
-
-            message = {
-                "event": "faceDetection",
-                "userInFront": face_found,
-                "faceX": faceX,
-                "faceY": faceY,
-                "secondFaceX": secondFaceX,
-                "secondFaceY": secondFaceY,
-                "headDirection": head_direction_text
-            }
-            await websocket.send(json.dumps(message))
-            print(f"WebSocket update sent: {message}")
-
-            if face_found:
-                for idx, face_landmarks in enumerate(faces):
-                    mp_drawing.draw_landmarks(
-                        image=frame,
-                        landmark_list=face_landmarks,
-                        connections=mp_face_mesh.FACEMESH_TESSELATION,
-                        landmark_drawing_spec=drawing_spec,
-                        connection_drawing_spec=drawing_spec)
-                text_x = int(faceX * img_w)
-                text_y = int(faceY * img_h) - 30
-                cv2.putText(frame, head_direction_text, (text_x, text_y),
-                            cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255, 0, 0), 2)
-
-            cv2.imshow("Perception Debug View", frame)
-            if cv2.waitKey(1) & 0xFF == 27:
+            result = await subscriber.get()
+            if result is None:
                 break
+            if isinstance(result, dict):
+                await websocket.send(json.dumps(result))
+                continue
 
-            await asyncio.sleep(0.03)
+            await websocket.send(result.packed if binary else result.payload)
+            stats.record(result, time.perf_counter())
 
     except websockets.exceptions.ConnectionClosedError:
-        print("WebSocket connection closed.")
+        log.info("WebSocket connection closed.")
     finally:
-        face_mesh.close()
-        cap.release()
-        cv2.destroyAllWindows()
+        engine.unsubscribe(subscriber)
 
 
-async def main():
+async def main(args):
     """
     Main function to start the WebSocket server.
     """
-    server = await websockets.serve(face_detection_server, "localhost", 8766)
+    preview = None
+    if args.preview_port:
+        preview = PreviewStream(args.preview_fps)
+        await preview.start(args.preview_host, args.preview_port)
+
+    # One engine per process, shared by every connected client
+    engine = PerceptionEngine(
+        device=args.camera,
+        publish_filter=PublishFilter(args.publish_mode, args.position_epsilon, args.heartbeat),
+        idle_max_stride=args.idle_max_stride,
+        headless=args.headless,
+        preview=preview,
+        make_tracker=functools.partial(FaceTracker, tracking=not args.no_tracking, roi_size=args.roi_size,
+                                       redetect_interval=args.redetect_interval, detect_width=args.detect_width),
+        gaze_fps=args.gaze_fps if args.gaze else 0,
+        startup_log=args.startup_log)
+    server = await websockets.serve(functools.partial(face_detection_server, engine=engine), "localhost", 8766,
+                                    select_subprotocol=wire.select_subprotocol((wire.FACE_DETECTION_PROTOCOL,)))
+    engine.record_timing("socket_bound_at", time.perf_counter() - _MODULE_LOADED)
+    log.info("WebSocket server started at ws://localhost:8766 (publish mode: %s)", args.publish_mode)
 
-    print("WebSocket server started at ws://localhost:8766")
-    await server.wait_closed()
+    # The heavy imports run only now that clients can connect; they get a perceptionStatus right away
+    await asyncio.get_running_loop().run_in_executor(None, load_vision_modules)
+    if args.warm_start:
+        engine.start()
+    try:
+        await server.wait_closed()
+    finally:
+        await engine.shutdown()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Perception node: streams faceDetection messages on ws://localhost:8766")
+    parser.add_argument("--camera", type=int, default=0, help="OpenCV camera index (default: 0)")
+    parser.add_argument("--publish-mode", choices=["every", "delta"], default="every",
+                        help="'every' sends each frame; 'delta' sends only changes plus a heartbeat")
+    parser.add_argument("--position-epsilon", type=float, default=POSITION_EPSILON,
+                        help="delta mode: face movement (normalised coords) that triggers a send")
+    parser.add_argument("--heartbeat", type=float, default=HEARTBEAT_INTERVAL,
+                        help="delta mode: resend the current state at least every N seconds")
+    parser.add_argument("--idle-max-stride", type=int, default=IDLE_MAX_STRIDE,
+                        help="max frames between inferences while no face is visible (1 = never skip)")
+    parser.add_argument("--no-tracking", action="store_true",
+                        help="search the full frame every time instead of tracking the face in a cropped ROI")
+    parser.add_argument("--roi-size", type=int, default=ROI_SIZE,
+                        help="side in px of the down-scaled face crop used while tracking")
+    parser.add_argument("--redetect-interval", type=int, default=REDETECT_INTERVAL,
+                        help="search the full frame at least every N frames while tracking")
+    parser.add_argument("--detect-width", type=int, default=DETECT_WIDTH,
+                        help="down-scale full frames to this width for detection (0 = full resolution)")
+    parser.add_argument("--gaze", action="store_true",
+                        help="estimate eye gaze from the iris landmarks in a separate process (adds gazeDirection etc.)")
+    parser.add_argument("--gaze-fps", type=float, default=GAZE_MAX_FPS,
+                        help="max frame rate of the gaze process")
+    parser.add_argument("--warm-start", action="store_true",
+                        help="open the camera and load/warm up the model at startup instead of on the first connection")
+    parser.add_argument("--startup-log", default=STARTUP_LOG_FILENAME,
+                        help=f"append the startup timings to this JSON-lines file (default: {STARTUP_LOG_FILENAME}; "
+                             f"'' to disable)")
+    parser.add_argument("--headless", action="store_true",
+                        help="no local debug window and no drawing (except for preview viewers)")
+    parser.add_argument("--preview-port", type=int, default=0,
+                        help="serve the debug view as an MJPEG stream on this port (0 = off)")
+    parser.add_argument("--preview-host", default="localhost",
+                        help="interface for the preview stream, e.g. 0.0.0.0 to watch from another machine")
+    parser.add_argument("--preview-fps", type=float, default=PREVIEW_FPS,
+                        help="max frame rate of the preview stream")
+    logsetup.add_arguments(parser, default_json=JSON_LOG_FILENAME)
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    args = parse_args()
+    log_listener = logsetup.configure("perception", args.log_level, args.log_json)
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        log.info("Perception node stopped.")
+    finally:
+        log_listener.stop()
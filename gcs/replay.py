@@ -0,0 +1,194 @@
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+
+import cv2
+import numpy as np
+
+import perception
+
+# Image types accepted when replaying a directory of frames
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+# Frame rate assumed for a directory of frames (videos carry their own)
+DEFAULT_FPS = 30.0
+
+# Numeric per-frame columns taken from the faceDetection message (None -> NaN)
+MESSAGE_COLUMNS = ["faceX", "faceY", "secondFaceX", "secondFaceY", "headYaw", "headPitch", "headRoll"]
+
+
+def open_source(path):
+    """
+    Returns (frame_count, fps) for a video file or a directory of frames.
+    """
+    if os.path.isdir(path):
+        return len(list_frame_files(path)), DEFAULT_FPS
+
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise SystemExit(f"Error: Could not open video {path}")
+    try:
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+    finally:
+        cap.release()
+    return frame_count, fps
+
+
+def list_frame_files(directory):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def read_batches(path, start, stop, batch_size):
+    """
+    Yields lists of (frame_index, frame) for frames [start, stop), `batch_size` at a time.
+    """
+    if os.path.isdir(path):
+        files = list_frame_files(path)[start:stop]
+        for offset in range(0, len(files), batch_size):
+            batch_files = files[offset:offset + batch_size]
+            yield [(start + offset + i, cv2.imread(f)) for i, f in enumerate(batch_files)]
+        return
+
+    cap = cv2.VideoCapture(path)
+    try:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        index = start
+        while index < stop:
+            batch = []
+            while index < stop and len(batch) < batch_size:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                batch.append((index, frame))
+                index += 1
+            if not batch:
+                break
+            yield batch
+            if len(batch) < batch_size and index < stop:
+                break  # decoder ran out before the expected end of the segment
+    finally:
+        cap.release()
+
+
+def prefetched(batches):
+    """
+    Decodes the next batch on a helper thread while the current one is analysed.
+    (OpenCV releases the GIL while decoding, so both overlap.)
+    """
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pending = pool.submit(next, batches, None)
+        while True:
+            batch = pending.result()
+            if batch is None:
+                return
+            pending = pool.submit(next, batches, None)
+            yield batch
+
+
+def process_segment(path, start, stop, batch_size, yaw_threshold, tracking=True):
+    """
+    Runs the live FaceMesh/yaw pipeline over frames [start, stop) of the source.
+    Runs in a worker process; FaceMesh (and ROI) tracking restarts at the beginning of each segment.
+    Returns (start, columns) with one numpy array per column.
+    """
+    perception.yaw_ratio_threshold = yaw_threshold
+    tracker = perception.FaceTracker(tracking=tracking)
+
+    frame_indices = []
+    user_in_front = []
+    head_direction = []
+    values = {key: [] for key in MESSAGE_COLUMNS}
+    try:
+        for batch in prefetched(read_batches(path, start, stop, batch_size)):
+            for index, frame in batch:
+                if frame is None:
+                    continue  # unreadable image in a frame directory
+                message, _ = perception.analyze_frame(tracker, frame)
+                frame_indices.append(index)
+                user_in_front.append(message["userInFront"])
+                head_direction.append(message["headDirection"])
+                for key in MESSAGE_COLUMNS:
+                    value = message[key]
+                    values[key].append(np.nan if value is None else value)
+    finally:
+        tracker.close()
+
+    columns = {
+        "frame": np.asarray(frame_indices, dtype=np.int64),
+        "userInFront": np.asarray(user_in_front, dtype=bool),
+        "headDirection": np.asarray(head_direction, dtype=str),
+    }
+    for key in MESSAGE_COLUMNS:
+        columns[key] = np.asarray(values[key], dtype=np.float32)
+    return start, columns
+
+
+def split_segments(frame_count, segments):
+    bounds = np.linspace(0, frame_count, segments + 1).astype(int)
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+def write_columns(path, columns):
+    """
+    Writes the columns to `path`: Parquet for *.parquet (needs pyarrow), otherwise a compressed .npz.
+    """
+    if path.endswith(".parquet"):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Error: writing .parquet needs pyarrow (pip install pyarrow); use an .npz output instead.")
+        pq.write_table(pa.table(columns), path)
+    else:
+        np.savez_compressed(path, **columns)
+
+
+def replay(path, output, workers, batch_size, yaw_threshold, tracking=True):
+    frame_count, fps = open_source(path)
+    if frame_count <= 0:
+        raise SystemExit(f"Error: no frames found in {path}")
+
+    segments = split_segments(frame_count, workers)
+    print(f"Replaying {frame_count} frames from {path} in {len(segments)} segments ({workers} workers)")
+
+    started = time.perf_counter()
+    with Pool(processes=workers) as pool:
+        results = pool.starmap(process_segment,
+                               [(path, start, stop, batch_size, yaw_threshold, tracking) for start, stop in segments])
+    elapsed = time.perf_counter() - started
+
+    results.sort(key=lambda item: item[0])
+    columns = {key: np.concatenate([cols[key] for _, cols in results]) for key in results[0][1]}
+    columns["timestamp"] = columns["frame"] / fps
+    write_columns(output, columns)
+
+    processed = len(columns["frame"])
+    print(f"Processed {processed} frames in {elapsed:.1f} s ({processed / elapsed:.1f} FPS), "
+          f"faces in {int(columns['userInFront'].sum())} frames. Results written to {output}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Run the perception pipeline over a recorded video (or a directory of frames) at full speed "
+                    "and write the per-frame faceDetection results to a columnar file.")
+    parser.add_argument("source", help="video file or directory of frame images (sorted by name)")
+    parser.add_argument("-o", "--output", default="face_detection.npz",
+                        help="output file: .npz (default) or .parquet (requires pyarrow)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes; the source is split into this many segments")
+    parser.add_argument("--batch-size", type=int, default=32, help="frames decoded per batch")
+    parser.add_argument("--yaw-threshold", type=float, default=perception.yaw_ratio_threshold,
+                        help="yaw ratio threshold used for headDirection")
+    parser.add_argument("--no-tracking", action="store_true",
+                        help="search the full frame every time instead of tracking the face in a cropped ROI")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    replay(args.source, args.output, max(1, args.workers), max(1, args.batch_size), args.yaw_threshold,
+           tracking=not args.no_tracking)
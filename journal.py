@@ -0,0 +1,205 @@
+"""
+Append-only journal of every message the logging server receives, and a streaming replay
+that rebuilds gaze_log.csv (and a per-turn timing table) from it.
+
+Journal format: one record per line, `<length> <json>\\n`, where <length> is the byte length of
+the JSON text. The length prefix lets the reader detect a record cut short by a crash; the JSON
+keeps the file greppable. Record fields:
+    type   'start' (server started) or 'msg' (message received)
+    mono   time.perf_counter_ns() at receipt (only comparable within one server run)
+    wall   wall-clock receipt time, ISO 8601 UTC
+    conn   connection id ('msg' only)
+    msg    the raw message text, exactly as received ('msg' with a text frame)
+    bin    base64 of the raw binary (msgpack, see wire.py) frame ('msg' with a binary frame)
+
+Usage: python journal.py gaze_events.journal --csv rebuilt_gaze_log.csv --turns-table turns.csv \
+           --analytics summary.json
+"""
+import argparse
+import base64
+import csv
+import json
+import os
+from datetime import datetime
+
+
+def encode_record(record):
+    payload = json.dumps(record, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return b'%d %s\n' % (len(payload), payload)
+
+
+def message_record(received_ns, arrival_time, connection_id, message):
+    record = {'type': 'msg', 'mono': received_ns, 'wall': arrival_time.isoformat(), 'conn': connection_id}
+    if isinstance(message, bytes):
+        record['bin'] = base64.b64encode(message).decode('ascii')
+    else:
+        record['msg'] = message
+    return record
+
+
+def decode_message(record):
+    """
+    The message dict carried by a 'msg' record. Raises ValueError if it cannot be decoded.
+    """
+    if 'bin' in record:
+        import wire
+        return wire.decode_event(base64.b64decode(record['bin']))
+    return json.loads(record['msg'])
+
+
+def read_records(path):
+    """
+    Streams records from a journal file. A truncated last record (e.g. after a crash) is skipped.
+    """
+    with open(path, 'rb') as f:
+        for line_number, line in enumerate(f, start=1):
+            length, _, payload = line.rstrip(b'\n').partition(b' ')
+            if not length.isdigit() or int(length) != len(payload):
+                print(f"Warning: skipping damaged journal record on line {line_number}")
+                continue
+            yield json.loads(payload)
+
+
+class JournalClock:
+    """
+    Replay clock for SessionManager: the receive time of the record being replayed, in seconds.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+TURN_TABLE_HEADER = ['participant', 'cardId', 'Robot', 'gazeDecision', 'reveal_timestamp',
+                     'reveal_to_robots_move_ms', 'move_duration', 'complete', 'missing_fields']
+
+
+def turn_table_row(turn):
+    reaction_ms = ''
+    if turn.reveal_ns is not None and turn.robots_move_ns is not None:
+        reaction_ms = f"{(turn.robots_move_ns - turn.reveal_ns) / 1e6:.3f}"
+    missing = turn.missing_fields()
+    return {
+        'participant': turn.participant, 'cardId': turn.card_id,
+        'Robot': turn.robot or '', 'gazeDecision': turn.gaze_decision or '',
+        'reveal_timestamp': turn.reveal_timestamp.isoformat() if turn.reveal_timestamp else '',
+        'reveal_to_robots_move_ms': reaction_ms,
+        'move_duration': '' if turn.move_duration is None else f"{turn.move_duration:.3f}",
+        'complete': not missing, 'missing_fields': ' '.join(missing),
+    }
+
+
+def replay(journal_path, csv_path, partial_csv_path=None, turns_table_path=None, analytics=None):
+    """
+    Rebuilds the combined CSV (and optionally the partial-turn CSV and a per-turn timing table)
+    in a single pass, feeding every combined row to `analytics` (an analytics.TurnAnalytics) if given. Memory stays bounded by the turns open at any one time, which are evicted
+    after server.TURN_TTL_SECONDS of journal time, just like in the live server.
+    """
+    import server  # the live mapping logic (build_csv_row, Carl offset, session matching)
+
+    outputs = []
+
+    def open_csv(path, header):
+        f = open(path, 'w', newline='', encoding='utf-8')
+        outputs.append(f)
+        writer = csv.DictWriter(f, fieldnames=header)
+        writer.writeheader()
+        return writer
+
+    combined = open_csv(csv_path, server.CSV_HEADER)
+    partial = open_csv(partial_csv_path, server.PARTIAL_CSV_HEADER) if partial_csv_path else None
+    turns_table = open_csv(turns_table_path, TURN_TABLE_HEADER) if turns_table_path else None
+
+    counts = {'records': 0, 'runs': 0, 'complete': 0, 'partial': 0, 'invalid': 0}
+
+    def finish_incomplete(turns):
+        for turn in turns:
+            counts['partial'] += 1
+            if partial is not None:
+                partial.writerow(server.build_partial_row(turn))
+            if turns_table is not None:
+                turns_table.writerow(turn_table_row(turn))
+
+    clock = JournalClock()
+    sessions = None
+    next_eviction = 0.0
+    try:
+        for record in read_records(journal_path):
+            counts['records'] += 1
+            clock.now = record['mono'] / 1e9
+            if record['type'] == 'start' or sessions is None:
+                # New server run: its monotonic clock and connection ids start over
+                if sessions is not None:
+                    finish_incomplete(list(sessions.turns.values()))
+                sessions = server.SessionManager(clock=clock)
+                next_eviction = clock.now + server.EVICTION_INTERVAL_SECONDS
+                counts['runs'] += 1
+                if record['type'] == 'start':
+                    continue
+
+            if clock.now >= next_eviction:
+                finish_incomplete(sessions.evict_expired())
+                next_eviction = clock.now + server.EVICTION_INTERVAL_SECONDS
+
+            try:
+                data = decode_message(record)
+            except ValueError:
+                counts['invalid'] += 1
+                continue
+            event_type = data.get('event')
+            if event_type not in server.TURN_EVENTS or not data.get('cardId'):
+                continue
+
+            turn = server.apply_turn_event(sessions, event_type, data, record['conn'], record['mono'],
+                                           datetime.fromisoformat(record['wall']))
+            if event_type != 'cardReveal' and not turn.missing_fields():
+                row = server.build_csv_row(turn.as_record())
+                combined.writerow(row)
+                if analytics is not None:
+                    analytics.add(row)
+                if turns_table is not None:
+                    turns_table.writerow(turn_table_row(turn))
+                sessions.close(turn)
+                counts['complete'] += 1
+
+        if sessions is not None:
+            finish_incomplete(list(sessions.turns.values()))
+    finally:
+        for f in outputs:
+            f.close()
+    return counts
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Rebuild gaze_log.csv and derived tables from a server event journal.")
+    parser.add_argument('journal', help="journal file written by server.py (--journal)")
+    parser.add_argument('--csv', default='gaze_log_rebuilt.csv', help="rebuilt combined record CSV")
+    parser.add_argument('--partial-csv', help="also write turns that never completed")
+    parser.add_argument('--turns-table', help="also write a per-turn timing table (reaction latency, move duration)")
+    parser.add_argument('--analytics', help="also write the per-participant/condition/difficulty summary "
+                                            "(as returned by the server's analyticsQuery) to this JSON file")
+    parser.add_argument('--carl-offset', type=float,
+                        help="seconds subtracted from move_duration in the Carl condition (default: the server's)")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if not os.path.exists(args.journal):
+        raise SystemExit(f"Error: journal {args.journal} not found")
+    if args.carl_offset is not None:
+        import server
+        server.CARL_CONDITION_OFFSET_S = args.carl_offset
+    turn_analytics = None
+    if args.analytics:
+        from analytics import TurnAnalytics
+        turn_analytics = TurnAnalytics()
+    counts = replay(args.journal, args.csv, args.partial_csv, args.turns_table, turn_analytics)
+    if turn_analytics is not None:
+        with open(args.analytics, 'w', encoding='utf-8') as f:
+            json.dump(turn_analytics.report(), f, indent=2)
+    print(f"Replayed {counts['records']} records from {counts['runs']} server run(s): "
+          f"{counts['complete']} complete turns written to {args.csv}, {counts['partial']} incomplete, "
+          f"{counts['invalid']} undecodable messages skipped")
@@ -0,0 +1,233 @@
+"""
+Logging shared by server.py and gcs/perception.py.
+
+Log calls only put the record on a bounded queue; a background thread formats it and writes it
+to the console (human-readable) and optionally to a JSON-lines file. The calling thread (the
+asyncio loop or the inference thread) never waits on stdout or the disk. When the queue is full,
+records are dropped and counted instead of blocking.
+
+High-frequency events are not logged one by one. They are counted in an EventSummary, which logs
+a single line per interval (default: every second) with the counts. Repeats of the same message
+beyond a small burst per second are suppressed too, and the suppressed count is reported on the
+next one that gets through.
+
+Usage:
+    log = logging.getLogger('server')
+    listener = logsetup.configure('server', level='INFO', json_path='server_log.jsonl')
+    log.info("Client connected: %s", address, extra={'connection': 7})  # extras become JSON fields
+    ...
+    listener.stop()
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+
+# Records waiting for the writer thread; more than this and new records are dropped
+LOG_QUEUE_SIZE = 10000
+
+# Per-second summaries of high-frequency events (see EventSummary)
+SUMMARY_INTERVAL_SECONDS = 1.0
+
+# Identical messages (same logger, level and format string) let through per interval before suppressing
+REPEAT_BURST = 5
+REPEAT_INTERVAL_SECONDS = 1.0
+
+CONSOLE_FORMAT = '%(asctime)s %(levelname)-7s %(name)s: %(message)s'
+
+# Attributes every LogRecord has; anything else was passed with extra= and goes into the JSON log
+_STANDARD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: ts, level, process, logger, msg, plus any extra= fields.
+    """
+
+    def __init__(self, process):
+        super().__init__()
+        self.process = process
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'process': self.process,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that drops records (and counts them) instead of blocking when the queue is full.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RepeatFilter(logging.Filter):
+    """
+    Lets through at most `burst` records with the same (logger, level, format string) per interval.
+    The next record that gets through says how many were suppressed.
+    """
+
+    def __init__(self, burst=REPEAT_BURST, interval=REPEAT_INTERVAL_SECONDS):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._windows = {}  # key -> [window_start, passed, suppressed]
+
+    def filter(self, record):
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+            elif window[1] < self.burst:
+                window[1] += 1
+                suppressed = 0
+            else:
+                window[2] += 1
+                return False
+        if suppressed:
+            record.suppressed = suppressed
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+
+class EventSummary:
+    """
+    Counts high-frequency events (e.g. one per message or per frame) and logs one summary line
+    with the counts per summary interval (see configure) instead of one line per event.
+    Thread-safe; count() is cheap.
+    """
+
+    def __init__(self, logger, label, level=logging.INFO):
+        self.logger = logger
+        self.label = label
+        self.level = level
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._window_start = time.monotonic()
+        _summaries.append(self)
+
+    def count(self, event, n=1):
+        with self._lock:
+            self._counts[event] = self._counts.get(event, 0) + n
+
+    def flush(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            counts, self._counts = self._counts, {}
+            elapsed = now - self._window_start
+            self._window_start = now
+        if counts:
+            total = sum(counts.values())
+            details = ', '.join(f"{event}={counts[event]}" for event in sorted(counts))
+            self.logger.log(self.level, "%s: %d in %.1f s (%s)", self.label, total, elapsed, details,
+                            extra={'summary': self.label, 'counts': counts, 'interval_s': round(elapsed, 3)})
+
+
+_summaries = []
+
+
+class LogListener(logging.handlers.QueueListener):
+    """
+    Writer thread for the queued records. Also flushes every EventSummary on its interval
+    and once more on stop().
+    """
+
+    def __init__(self, queue_handler, handlers, summary_interval=SUMMARY_INTERVAL_SECONDS):
+        super().__init__(queue_handler.queue, *handlers, respect_handler_level=True)
+        self.queue_handler = queue_handler
+        self.summary_interval = summary_interval
+        self._stop_summaries = threading.Event()
+        self._summary_thread = None
+
+    def start(self):
+        super().start()
+        self._summary_thread = threading.Thread(target=self._flush_summaries, name='log-summaries', daemon=True)
+        self._summary_thread.start()
+
+    def stop(self):
+        self._stop_summaries.set()
+        if self._summary_thread is not None:
+            self._summary_thread.join()
+            self._summary_thread = None
+        for summary in list(_summaries):
+            summary.flush()
+        if self.queue_handler.dropped:
+            logging.getLogger(__name__).warning("%d log records dropped (queue full)", self.queue_handler.dropped)
+        super().stop()
+        for handler in self.handlers:
+            handler.close()
+
+    def _flush_summaries(self):
+        while not self._stop_summaries.wait(self.summary_interval):
+            for summary in list(_summaries):
+                summary.flush()
+
+
+def configure(process, level='INFO', json_path=None, console=True, summary_interval=SUMMARY_INTERVAL_SECONDS):
+    """
+    Routes all logging through a non-blocking queue to a background writer thread.
+    Returns the started LogListener; call its stop() on shutdown to write what is still queued.
+    """
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(RepeatFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+
+    handlers = []
+    if console:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+        handlers.append(console_handler)
+    if json_path:
+        json_handler = logging.FileHandler(json_path, encoding='utf-8')
+        json_handler.setFormatter(JsonFormatter(process))
+        handlers.append(json_handler)
+
+    listener = LogListener(queue_handler, handlers, summary_interval=summary_interval)
+    listener.start()
+    return listener
+
+
+def add_arguments(parser, default_json=None):
+    """
+    Adds --log-level and --log-json to an argparse parser.
+    """
+    parser.add_argument('--log-level', default='INFO', choices=LOG_LEVELS,
+                        help="console/JSON log level; DEBUG logs every message (default: INFO)")
+    parser.add_argument('--log-json', default=default_json,
+                        help="also write the log as JSON lines to this file" +
+                             (f" (default: {default_json}; '' to disable)" if default_json else ""))
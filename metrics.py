@@ -0,0 +1,87 @@
+import math
+
+
+class LatencyHistogram:
+    """
+    Log-bucketed histogram of non-negative values (e.g. nanoseconds from time.perf_counter_ns).
+    Memory stays bounded no matter how many samples are added; quantiles are accurate to
+    about `relative_error` of the true value.
+    """
+    __slots__ = ('_log_base', '_base', 'buckets', 'count', 'total', 'min', 'max')
+
+    def __init__(self, relative_error=0.01):
+        self._base = (1 + relative_error) / (1 - relative_error)
+        self._log_base = math.log(self._base)
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        # Bucket i holds values in [base**i, base**(i+1)); values below 1 share bucket -1
+        index = int(math.log(value) / self._log_base) if value >= 1 else -1
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """
+        Approximate q-quantile (0 <= q <= 1), or None if the histogram is empty.
+        """
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                estimate = 0 if index < 0 else 2 * self._base ** index * self._base / (1 + self._base)
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+    def snapshot(self, scale=1e-6):
+        """
+        Summary dict (count, mean, min, p50, p95, p99, max); values multiplied by `scale`
+        (default: nanoseconds -> milliseconds).
+        """
+        if not self.count:
+            return {'count': 0}
+
+        def scaled(value):
+            return round(value * scale, 3)
+
+        return {
+            'count': self.count,
+            'mean': scaled(self.total / self.count),
+            'min': scaled(self.min),
+            'p50': scaled(self.quantile(0.50)),
+            'p95': scaled(self.quantile(0.95)),
+            'p99': scaled(self.quantile(0.99)),
+            'max': scaled(self.max),
+        }
+
+
+class LatencyMetrics:
+    """
+    Named latency histograms fed with time.perf_counter_ns() timestamps.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+
+    def record(self, name, start_ns, end_ns):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = LatencyHistogram()
+        histogram.add(max(0, end_ns - start_ns))
+
+    def snapshot(self):
+        """
+        {name: summary in milliseconds} for every histogram.
+        """
+        return {name: self.histograms[name].snapshot() for name in sorted(self.histograms)}
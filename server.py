@@ -1,10 +1,26 @@
+import abc
+import argparse
 import asyncio
+import itertools
 import websockets
 import json
 import csv
+import logging
 import os
+import signal
+import sys
+import time
+from dataclasses import dataclass
 from datetime import datetime, timezone # Import timezone
 
+import journal
+import logsetup
+import wire
+from analytics import TurnAnalytics
+from metrics import LatencyMetrics
+
+log = logging.getLogger('server')
+
 CSV_FILENAME = 'gaze_log.csv'
 # Updated header with renamed columns
 CSV_HEADER = [
@@ -13,326 +29,925 @@ CSV_HEADER = [
     'participants_side_choice', 'Robot', 'gazeDecision', 'move_duration'
 ]
 
-# Global dictionary to store records keyed by cardId.
-card_records = {}
+# CSV header keys whose value comes from a differently named internal record key
+# ('timestamp' and 'move_duration' are formatted separately in build_csv_row).
+CSV_FIELD_SOURCES = {
+    'correct_answer': 'answer',
+    'participants_side_choice': 'side_choice_raw',
+    'correct_side': 'side',
+}
+# Built once: (header key, internal key) for every column copied straight from the record
+CSV_COPIED_FIELDS = [(key, CSV_FIELD_SOURCES.get(key, key)) for key in CSV_HEADER
+                     if key not in ('timestamp', 'move_duration')]
+
+# Buffered CSV writing (see CsvLogWriter): a batch is written once this many rows are
+# waiting or this many seconds after its first row arrived, whichever comes first.
+LOG_FLUSH_ROWS = 20
+LOG_FLUSH_INTERVAL_SECONDS = 1.0
+
+# Outgoing messages buffered per client. When the queue is full the oldest message is dropped;
+# a client that stays that far behind for CLIENT_LAG_DISCONNECT_SECONDS is disconnected.
+CLIENT_SEND_QUEUE_SIZE = 100
+CLIENT_LAG_DISCONNECT_SECONDS = 10.0
+
+# move_duration in the Carl condition is reduced by this offset when logged (see build_csv_row).
+# !! IMPORTANT: CARL_CONDITION_IDENTIFIER must be the EXACT string used in the 'Robot' data field !!
+CARL_CONDITION_IDENTIFIER = "Carl condition"
+CARL_CONDITION_OFFSET_S = 2.0
+# Robot values the GCS sends (gcs/js/gaze-controller.js); each gets its own reaction-latency histogram
+ROBOT_CONDITIONS = ("Ryan condition", "Ivan condition", CARL_CONDITION_IDENTIFIER, "default")
+
+# Structured log (JSON lines, see logsetup.py), next to the human-readable console output
+JSON_LOG_FILENAME = 'server_log.jsonl'
+
+# Every received message is appended to this journal (see journal.py); fsync'ed at this interval
+JOURNAL_FILENAME = 'gaze_events.journal'
+JOURNAL_FSYNC_INTERVAL_SECONDS = 5.0
+
+# Incomplete turns (e.g. a card that was revealed but never dropped) are evicted after this many
+# seconds and written to PARTIAL_CSV_FILENAME together with the fields that were still missing.
+TURN_TTL_SECONDS = 15 * 60
+EVICTION_INTERVAL_SECONDS = 30
+PARTIAL_CSV_FILENAME = 'gaze_log_partial.csv'
+PARTIAL_CSV_HEADER = CSV_HEADER + ['missing_fields']
+
+
+@dataclass(slots=True)
+class TurnRecord:
+    """
+    Everything collected for one card turn of one participant (cardReveal + RobotsMove + cardDropped).
+    Fields stay None until the event carrying them has arrived.
+    """
+    participant: str
+    card_id: str
+    connection_id: int          # connection the game events arrive on
+    opened_at: float            # SessionManager clock (time.monotonic()) when the turn was created, for TTL eviction
+    event_arrival_timestamp: datetime | None = None
+    reveal_timestamp: datetime | None = None
+    reveal_ns: int | None = None       # time.perf_counter_ns() at cardReveal arrival (monotonic, for durations)
+    robots_move_ns: int | None = None  # time.perf_counter_ns() at RobotsMove arrival
+    question: str | None = None
+    difficulty: str | None = None
+    answer: object = None
+    side: str | None = None
+    side_choice_raw: str | None = None
+    robot: str | None = None
+    gaze_decision: str | None = None
+    move_duration: float | None = None
+
+    # Internal record key -> attribute; a turn is complete once all of them are set
+    REQUIRED = {
+        'side': 'side', 'answer': 'answer', 'question': 'question', 'difficulty': 'difficulty',
+        'side_choice_raw': 'side_choice_raw', 'Robot': 'robot', 'gazeDecision': 'gaze_decision',
+    }
+
+    def update_from_game(self, data):
+        for key in ('question', 'difficulty', 'answer', 'side'):
+            if key in data:
+                setattr(self, key, data[key])
+
+    def missing_fields(self):
+        return [key for key, attr in self.REQUIRED.items() if getattr(self, attr) is None]
+
+    def as_record(self):
+        """
+        Returns the turn as a dict with the internal record keys used by write_combined_record.
+        """
+        record = {
+            'participant': self.participant, 'cardId': self.card_id,
+            'Robot': self.robot, 'gazeDecision': self.gaze_decision,
+            'move_duration': self.move_duration,
+        }
+        for key in ('question', 'difficulty', 'answer', 'side', 'side_choice_raw'):
+            record[key] = getattr(self, key)
+        if self.event_arrival_timestamp is not None:
+            record['event_arrival_timestamp'] = self.event_arrival_timestamp
+        return record
+
+
+class SessionManager:
+    """
+    Open turns keyed by (participant, game connection, cardId), so concurrent sessions that reveal
+    the same question no longer overwrite each other.
+    RobotsMove messages arrive on the GCS connection, so they are matched by participant (if sent)
+    and cardId, falling back to the most recently opened turn for that card.
+    """
 
-def initialize_csv_file():
+    def __init__(self, ttl=TURN_TTL_SECONDS, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock  # journal replay passes the recorded receive time instead
+        self.turns = {}
+        self._keys_by_card = {}
+        self.completed_turns = 0
+        self.evicted_turns = 0
+        self.peak_open_turns = 0
+        # Running size of the open turns (see approximate_size), kept up to date per turn so the
+        # peak is exact without re-measuring every open turn on each event
+        self._turn_bytes = {}   # key -> size of the key, the record and its field values
+        self._open_bytes = 0    # sum of _turn_bytes plus the per-card key sets
+        self.peak_open_turns_bytes = 0
+
+    def _open(self, participant, card_id, connection_id):
+        key = (participant, connection_id, card_id)
+        turn = TurnRecord(participant, card_id, connection_id, self.clock())
+        self.turns[key] = turn
+        keys = self._keys_by_card.get(card_id)
+        before = 0 if keys is None else sys.getsizeof(keys)
+        if keys is None:
+            keys = self._keys_by_card[card_id] = set()
+        keys.add(key)
+        self._open_bytes += sys.getsizeof(keys) - before
+        self.peak_open_turns = max(self.peak_open_turns, len(self.turns))
+        self.track_size(turn)
+        return turn
+
+    def track_size(self, turn):
+        """
+        Re-measures a turn after its fields changed and updates peak_open_turns_bytes.
+        """
+        key = (turn.participant, turn.connection_id, turn.card_id)
+        size = sys.getsizeof(key) + sys.getsizeof(turn)
+        size += sum(sys.getsizeof(getattr(turn, name)) for name in TurnRecord.__slots__)
+        self._open_bytes += size - self._turn_bytes.get(key, 0)
+        self._turn_bytes[key] = size
+        self.peak_open_turns_bytes = max(self.peak_open_turns_bytes, self.approximate_size())
+
+    def game_turn(self, participant, card_id, connection_id, create=True):
+        """
+        Returns the turn for a game event (cardReveal / cardDropped), optionally creating it.
+        """
+        turn = self.turns.get((participant, connection_id, card_id))
+        if turn is None and create:
+            turn = self._open(participant, card_id, connection_id)
+        return turn
+
+    def find_turn_for_card(self, card_id, participant=''):
+        """
+        Returns the open turn a GCS event (RobotsMove) belongs to, or None.
+        """
+        candidates = [self.turns[key] for key in self._keys_by_card.get(card_id, ())
+                      if not participant or key[0] == participant]
+        if len(candidates) > 1:
+            log.warning("%d open turns for cardId %s; using the most recent one.", len(candidates), card_id)
+        return max(candidates, key=lambda turn: turn.opened_at, default=None)
+
+    def close(self, turn, completed=True):
+        key = (turn.participant, turn.connection_id, turn.card_id)
+        if self.turns.pop(key, None) is None:
+            return
+        self._open_bytes -= self._turn_bytes.pop(key)
+        keys = self._keys_by_card[turn.card_id]
+        before = sys.getsizeof(keys)
+        keys.discard(key)
+        if keys:
+            self._open_bytes += sys.getsizeof(keys) - before
+        else:
+            self._open_bytes -= before
+            del self._keys_by_card[turn.card_id]
+        if completed:
+            self.completed_turns += 1
+        else:
+            self.evicted_turns += 1
+
+    def evict_expired(self, now=None):
+        """
+        Removes and returns all turns older than the TTL.
+        """
+        now = self.clock() if now is None else now
+        expired = [turn for turn in self.turns.values() if now - turn.opened_at > self.ttl]
+        for turn in expired:
+            self.close(turn, completed=False)
+        return expired
+
+    def approximate_size(self):
+        """
+        Rough memory held by the open turns in bytes (records, their field values and the indexes).
+        """
+        return sys.getsizeof(self.turns) + sys.getsizeof(self._keys_by_card) + self._open_bytes
+
+    def metrics(self):
+        now = self.clock()
+        open_by_participant = {}
+        for turn in self.turns.values():
+            open_by_participant[turn.participant] = open_by_participant.get(turn.participant, 0) + 1
+        return {
+            'open_turns': len(self.turns),
+            'peak_open_turns': self.peak_open_turns,
+            'open_turns_bytes': self.approximate_size(),
+            'peak_open_turns_bytes': self.peak_open_turns_bytes,
+            'open_turns_by_participant': open_by_participant,
+            'oldest_open_turn_age_s': round(max((now - t.opened_at for t in self.turns.values()), default=0.0), 3),
+            'completed_turns': self.completed_turns,
+            'evicted_turns': self.evicted_turns,
+        }
+
+
+sessions = SessionManager()
+
+# Events that make up a card turn; everything else is broadcast
+TURN_EVENTS = ('cardReveal', 'cardDropped', 'RobotsMove')
+# Events the server answers itself (see handler)
+CONTROL_EVENTS = ('serverStatus', 'analyticsQuery', 'subscribe')
+
+
+def histogram_name(prefix, name, known):
+    """
+    f'{prefix}.{name}' for a name in `known`, else f'{prefix}.other'. Names come from client messages,
+    so this keeps the number of latency histograms bounded.
+    """
+    return f"{prefix}.{name if name in known else 'other'}"
+
+
+def apply_turn_event(sessions, event_type, data, connection_id, received_ns, arrival_time):
+    """
+    Updates the matching turn with a cardReveal / cardDropped / RobotsMove event (which must carry a cardId)
+    and returns it. Shared by the live handler and the journal replay.
+    """
+    card_id = data['cardId']
+    participant_name = data.get('participant', '')
+
+    if event_type == 'cardReveal':
+        turn = sessions.game_turn(participant_name, card_id, connection_id)
+        turn.event_arrival_timestamp = arrival_time
+        turn.reveal_timestamp = arrival_time # Store reveal time
+        turn.reveal_ns = received_ns
+        log.debug("Stored reveal timestamp for cardId %s: %s", card_id, arrival_time.isoformat())
+
+        # Store relevant data (question, difficulty, answer, side)
+        turn.update_from_game(data)
+
+    elif event_type == 'cardDropped':
+        turn = sessions.game_turn(participant_name, card_id, connection_id, create=False)
+        if turn is None:
+             log.warning("cardDropped received for unknown cardId %s. Storing partial data.", card_id)
+             turn = sessions.game_turn(participant_name, card_id, connection_id)
+
+        drop_time = arrival_time
+        turn.event_arrival_timestamp = arrival_time
+        log.debug("Processing drop for cardId %s at %s", card_id, drop_time.isoformat())
+
+        # Store choice as 'side_choice_raw'
+        turn.update_from_game(data)
+        turn.side_choice_raw = data.get('side_choice')
+
+        # Calculate Duration ('move_duration') from the monotonic clock (immune to wall-clock jumps)
+        if turn.reveal_ns is not None:
+            duration_seconds = (received_ns - turn.reveal_ns) / 1e9
+            turn.move_duration = duration_seconds
+            log.debug("Calculated duration for cardId %s: %.3fs", card_id, duration_seconds)
+        else:
+            log.warning("cardDropped received for cardId %s, but no reveal_timestamp found.", card_id)
+            turn.move_duration = None
+
+    else: # RobotsMove
+         turn = sessions.find_turn_for_card(card_id, participant_name)
+         if turn is None:
+             log.warning("RobotsMove received for unknown cardId %s. Storing partial data.", card_id)
+             turn = sessions.game_turn(participant_name, card_id, connection_id)
+         turn.event_arrival_timestamp = arrival_time
+         turn.robots_move_ns = received_ns
+         turn.robot = data.get('Robot')
+         turn.gaze_decision = data.get('gazeDecision')
+
+    sessions.track_size(turn)
+    return turn
+
+# Monotonic per-stage latency histograms (see the handler), returned by the serverStatus query:
+#   parse                      message received -> JSON parsed
+#   forward.cardReveal         received -> queued for every subscribed GCS
+#   send                       queued on a client channel -> written to its socket
+#   log                        received -> combined record queued for the CSV writer
+#   csv_flush                  time to write one batch of rows to disk
+#   handle.<event>             received -> handling finished
+#   reveal_to_robots_move[.<Robot>]  cardReveal received -> the GCS's RobotsMove received
+latency = LatencyMetrics()
+
+# Running per-participant/condition/difficulty aggregates of the logged records, see analyticsQuery
+analytics = TurnAnalytics()
+
+# Per-second counts instead of per-message log lines (see logsetup.EventSummary)
+message_summary = logsetup.EventSummary(log, "Messages")
+turn_summary = logsetup.EventSummary(log, "Turns")
+
+def initialize_csv_file(filename=CSV_FILENAME):
     """
     Create the CSV file with headers if it doesn't already exist.
     Uses the updated CSV_HEADER with renamed columns.
     """
-    if not os.path.exists(CSV_FILENAME):
-        with open(CSV_FILENAME, 'w', newline='', encoding='utf-8') as csvfile:
+    if not os.path.exists(filename):
+        with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
             writer = csv.DictWriter(csvfile, fieldnames=CSV_HEADER)
             writer.writeheader()
-        print(f"CSV file {CSV_FILENAME} created with headers: {CSV_HEADER}")
+        log.info("CSV file %s created with headers: %s", filename, CSV_HEADER)
     else:
         # Optional: Check if existing header matches
         try:
-            with open(CSV_FILENAME, 'r', newline='', encoding='utf-8') as csvfile:
+            with open(filename, 'r', newline='', encoding='utf-8') as csvfile:
                 reader = csv.reader(csvfile)
                 existing_header = next(reader, None)
                 if existing_header and 'move_duration' not in existing_header:
-                     print(f"Warning: CSV file exists but is missing the 'move_duration' column. New rows will have it.")
+                     log.warning("CSV file exists but is missing the 'move_duration' column. New rows will have it.")
                 elif existing_header and ('answer' in existing_header or 'side_choice' in existing_header or 'reveal_to_drop_duration_s' in existing_header):
-                     print(f"Warning: CSV file seems to have old column names (e.g., 'answer', 'side_choice'). New data will use: {CSV_HEADER}")
+                     log.warning("CSV file seems to have old column names (e.g., 'answer', 'side_choice'). New data will use: %s", CSV_HEADER)
                 elif existing_header != CSV_HEADER:
-                    print(f"Warning: CSV header mismatch or unexpected columns. Expected {CSV_HEADER}, found {existing_header}. Consider backing up the file.")
+                    log.warning("CSV header mismatch or unexpected columns. Expected %s, found %s. Consider backing up the file.", CSV_HEADER, existing_header)
                 else:
-                    print(f"CSV file {CSV_FILENAME} already exists with correct headers.")
+                    log.info("CSV file %s already exists with correct headers.", filename)
         except Exception as e:
-            print(f"Could not read existing CSV header: {e}")
+            log.error("Could not read existing CSV header: %s", e)
 
 
-def write_combined_record(record):
+def build_csv_row(record):
     """
-    Maps internal record keys to the final CSV header keys (including renames),
-    adjusts move_duration based on Robot condition (-2s for 'Carl condition'),
-    and writes the filtered record to the CSV.
+    Maps internal record keys to the final CSV header keys (including renames)
+    and adjusts move_duration based on Robot condition (-CARL_CONDITION_OFFSET_S for the Carl condition).
     """
     record_timestamp = record.get('event_arrival_timestamp', datetime.now(timezone.utc))
     record['timestamp'] = record_timestamp.isoformat() # Store as ISO format string
 
     # --- Adjust move_duration based on Robot condition --- START ---
 
-    # !! IMPORTANT: Replace "Carl condition" below with the EXACT string identifier !!
-    # !! used in your 'Robot' data field for this specific condition.        !!
-    carl_condition_identifier = "Carl condition" # <<< MODIFY THIS VALUE AS NEEDED
-
     robot_condition = record.get('Robot')           # Get the Robot condition value
     original_duration = record.get('move_duration') # Get the calculated duration
 
     final_duration = original_duration # Start with the original duration
 
     # Check if it's the Carl condition and if the duration is a valid number
-    if robot_condition == carl_condition_identifier:
+    if robot_condition == CARL_CONDITION_IDENTIFIER:
         if isinstance(original_duration, (int, float)):
-            final_duration = original_duration - 2.0
+            final_duration = original_duration - CARL_CONDITION_OFFSET_S
             # Optional: Prevent duration from going below zero if desired
             # final_duration = max(0, final_duration)
-            print(f"Adjusting duration for Carl condition (Card {record.get('cardId', 'N/A')}): {original_duration:.3f} -> {final_duration:.3f}")
+            log.debug("Adjusting duration for Carl condition (Card %s): %.3f -> %.3f",
+                      record.get('cardId', 'N/A'), original_duration, final_duration)
         else:
             # Handle cases where duration wasn't calculated or is not a number
-            print(f"Cannot adjust duration for Carl condition (Card {record.get('cardId', 'N/A')}): original duration invalid ({original_duration})")
+            log.warning("Cannot adjust duration for Carl condition (Card %s): original duration invalid (%s)",
+                        record.get('cardId', 'N/A'), original_duration)
             # Keep final_duration as the original non-numeric value (e.g., None or '')
 
     # --- Adjust move_duration based on Robot condition --- END ---
 
 
     # --- Map internal data keys to the final CSV Header keys ---
-    filtered_record = {}
-    for header_key in CSV_HEADER:
-        if header_key == 'timestamp':
-            filtered_record[header_key] = record.get('timestamp', '')
-        elif header_key == 'correct_answer':
-            filtered_record[header_key] = record.get('answer', '')
-        elif header_key == 'participants_side_choice':
-            filtered_record[header_key] = record.get('side_choice_raw', '')
-        elif header_key == 'move_duration':
-            # Format the final duration (original or adjusted) for the CSV
-            duration_to_format = final_duration # Use the potentially adjusted value
-            if isinstance(duration_to_format, (int, float)):
-                 filtered_record[header_key] = f"{duration_to_format:.3f}" # Format to 3 decimals
-            else:
-                 filtered_record[header_key] = '' # Leave blank if not numeric
-        elif header_key == 'correct_side':
-             filtered_record[header_key] = record.get('side', '')
-        else:
-            # For other keys, assume header name matches internal key name
-            filtered_record[header_key] = record.get(header_key, '')
-    # --- End Mapping ---
+    filtered_record = {header_key: record.get(source_key, '') for header_key, source_key in CSV_COPIED_FIELDS}
+    filtered_record['timestamp'] = record['timestamp']
+    # Format the final duration (original or adjusted) to 3 decimals; blank if not numeric
+    filtered_record['move_duration'] = f"{final_duration:.3f}" if isinstance(final_duration, (int, float)) else ''
+    return filtered_record
+
+
+class BatchedFileWriter(abc.ABC):
+    """
+    Appends items to a file from a dedicated task fed by an asyncio queue, so disk I/O never
+    blocks message handling. Items are written in batches (LOG_FLUSH_ROWS / LOG_FLUSH_INTERVAL_SECONDS)
+    from a worker thread, the file stays open, and close() writes whatever is still queued.
+    Subclasses implement _open_file() and _write_items(); _idle_timeout() / _on_idle() let them
+    do deferred work (e.g. an fsync) once no new items have arrived for a while.
+    """
+
+    def __init__(self, filename, flush_rows=LOG_FLUSH_ROWS, flush_interval=LOG_FLUSH_INTERVAL_SECONDS):
+        self.filename = filename
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.rows_written = 0
+        self._queue = None
+        self._file = None
+        self._task = None
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._open_file()
+        self._task = asyncio.create_task(self._run())
+
+    def write(self, item):
+        """
+        Queues an item for writing; never blocks.
+        """
+        self._queue.put_nowait(item)
+
+    async def close(self):
+        """
+        Writes all queued items and closes the file.
+        """
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)  # sentinel: flush and stop
+        await self._task
+        self._task = None
+        await asyncio.to_thread(self._close_file)
+        log.info("Closed %s (%d rows written this session)", self.filename, self.rows_written)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        closing = False
+        while not closing:
+            try:
+                item = await asyncio.wait_for(self._queue.get(), self._idle_timeout())
+            except asyncio.TimeoutError:
+                await asyncio.to_thread(self._on_idle)
+                continue
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.flush_rows:
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    closing = True
+                    break
+                batch.append(item)
+            await asyncio.to_thread(self._write_batch, batch)
+
+    def _write_batch(self, batch):
+        try:
+            self._write_items(batch)
+            self._file.flush()
+            self.rows_written += len(batch)
+        except (IOError, ValueError) as e:
+            log.error("Error writing %d rows to %s: %s", len(batch), self.filename, e)
+
+    def _close_file(self):
+        self._file.close()
+
+    def _idle_timeout(self):
+        """
+        Seconds to wait for the next item before calling _on_idle(); None waits indefinitely.
+        """
+        return None
+
+    def _on_idle(self):
+        pass
+
+    @abc.abstractmethod
+    def _open_file(self):
+        """
+        Opens self.filename into self._file.
+        """
+
+    @abc.abstractmethod
+    def _write_items(self, batch):
+        """
+        Writes a batch of items to self._file (called from a worker thread).
+        """
+
+
+class CsvLogWriter(BatchedFileWriter):
+    """
+    Batched writer for CSV rows (dicts keyed by `header`).
+    """
+
+    def __init__(self, filename, header, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.header = header
+        self._writer = None
+
+    def _open_file(self):
+        self._file = open(self.filename, 'a', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=self.header)
+        if self._file.tell() == 0:
+            self._writer.writeheader()
+            self._file.flush()
+
+    def _write_items(self, batch):
+        started_ns = time.perf_counter_ns()
+        self._writer.writerows(batch)
+        latency.record('csv_flush', started_ns, time.perf_counter_ns())
+
+
+class JournalWriter(BatchedFileWriter):
+    """
+    Batched writer for encoded journal records (bytes, see journal.py). Written records are
+    fsync'ed at most JOURNAL_FSYNC_INTERVAL_SECONDS later (by the next batch, or on a timer once
+    traffic stops) and on close, so a crash loses at most that much.
+    """
+
+    def __init__(self, filename, fsync_interval=JOURNAL_FSYNC_INTERVAL_SECONDS, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.fsync_interval = fsync_interval
+        self._last_fsync = 0.0
+        self._unsynced = False
+
+    def record(self, record):
+        self.write(journal.encode_record(record))
+
+    def _open_file(self):
+        self._file = open(self.filename, 'ab')
+        self._last_fsync = time.monotonic()
+
+    def _write_items(self, batch):
+        self._file.write(b''.join(batch))
+        self._unsynced = True
+        if time.monotonic() - self._last_fsync >= self.fsync_interval:
+            self._fsync()
+
+    def _idle_timeout(self):
+        if not self._unsynced:
+            return None
+        return max(0.0, self._last_fsync + self.fsync_interval - time.monotonic())
+
+    def _on_idle(self):
+        if self._unsynced:
+            self._fsync()
+
+    def _fsync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._last_fsync = time.monotonic()
+        self._unsynced = False
+
+    def _close_file(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+
+combined_log = CsvLogWriter(CSV_FILENAME, CSV_HEADER)
+partial_log = CsvLogWriter(PARTIAL_CSV_FILENAME, PARTIAL_CSV_HEADER)
+event_journal = JournalWriter(JOURNAL_FILENAME)
+
+
+def build_partial_row(turn):
+    """
+    PARTIAL_CSV_HEADER row for an incomplete turn: the CSV row plus the fields that never arrived.
+    Shared by the live server and the journal replay.
+    """
+    row = build_csv_row(turn.as_record())
+    row['missing_fields'] = ' '.join(turn.missing_fields())
+    return row
+
+
+def write_partial_record(turn):
+    """
+    Queues an evicted, incomplete turn for PARTIAL_CSV_FILENAME, listing the fields that never arrived.
+    """
+    row = build_partial_row(turn)
+    partial_log.write(row)
+    turn_summary.count('partial')
+    log.info("Logged partial record for participant %r, cardId %s (missing: %s)",
+             turn.participant, turn.card_id, row['missing_fields'])
+
+
+def write_combined_record(record):
+    """
+    Maps the record to the CSV header (see build_csv_row), queues it for the CSV writer
+    and adds it to the running analytics.
+    """
+    filtered_record = build_csv_row(record)
+    combined_log.write(filtered_record)
+    analytics.add(filtered_record)
+    turn_summary.count('logged')
+    log.debug("Logged combined record for cardId %s", filtered_record.get('cardId', 'N/A'))
 
-    # --- CSV Writing Logic --- (Remains the same)
+
+async def evict_stale_turns():
+    """
+    Periodically evicts turns that stayed incomplete for longer than TURN_TTL_SECONDS.
+    """
+    while True:
+        await asyncio.sleep(EVICTION_INTERVAL_SECONDS)
+        for turn in sessions.evict_expired():
+            write_partial_record(turn)
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of this process in MB, or None where the resource module is unavailable (Windows).
+    """
     try:
-        with open(CSV_FILENAME, 'a', newline='', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=CSV_HEADER)
-            csvfile.seek(0, os.SEEK_END)
-            if csvfile.tell() == 0:
-                 writer.writeheader()
-            writer.writerow(filtered_record)
-        print(f"Logged combined record for cardId {filtered_record.get('cardId', 'N/A')}")
-    except IOError as e:
-        print(f"Error writing to CSV file {CSV_FILENAME}: {e}")
-    except Exception as e:
-        print(f"An unexpected error occurred during CSV writing: {e}")
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+class ClientChannel:
     """
-    Maps internal record keys to the final CSV header keys (including renames)
-    and writes the filtered record to the CSV.
+    Outgoing side of one connection: a bounded send queue drained by its own sender task,
+    so a slow or half-dead client never delays message handling or other clients.
+
+    Routing: a client that never sent a `subscribe` message receives every broadcast (legacy
+    behaviour). After {"event": "subscribe", "topics": [...], "participant": "..."} it only
+    receives the listed topics, optionally only for that participant.
+
+    Encoding: JSON text frames, or msgpack binary frames if the client negotiated
+    wire.EVENTS_PROTOCOL when connecting.
     """
-    record_timestamp = record.get('event_arrival_timestamp', datetime.now(timezone.utc))
-    record['timestamp'] = record_timestamp.isoformat() # Store as ISO format string
 
-    filtered_record = {}
-    for header_key in CSV_HEADER:
-        if header_key == 'timestamp':
-            filtered_record[header_key] = record.get('timestamp', '')
-        elif header_key == 'correct_answer':
-            filtered_record[header_key] = record.get('answer', '') # Map internal 'answer'
-        elif header_key == 'participants_side_choice':
-            filtered_record[header_key] = record.get('side_choice_raw', '') # Map internal 'side_choice_raw'
-        elif header_key == 'move_duration':
-            duration = record.get('move_duration', '') # Use new internal key 'move_duration'
-            if isinstance(duration, (int, float)):
-                 filtered_record[header_key] = f"{duration:.3f}"
-            else:
-                 filtered_record[header_key] = ''
-        elif header_key == 'correct_side':
-             filtered_record[header_key] = record.get('side', '') # Map internal 'side'
+    def __init__(self, websocket, connection_id):
+        self.websocket = websocket
+        self.connection_id = connection_id
+        self.binary = getattr(websocket, 'subprotocol', None) == wire.EVENTS_PROTOCOL
+        self.topics = None
+        self.participant = None
+        self.dropped = 0
+        self._queue = asyncio.Queue(CLIENT_SEND_QUEUE_SIZE)
+        self._lagging_since = None
+        self._disconnecting = False
+        self._task = asyncio.create_task(self._sender())
+
+    def subscribe(self, topics, participant=None):
+        self.topics = set(topics)
+        self.participant = participant or None
+
+    def wants(self, topic, participant=None):
+        if self.topics is not None and topic not in self.topics:
+            return False
+        return self.participant is None or not participant or participant == self.participant
+
+    def reply(self, data):
+        """
+        Encodes a message dict in this client's format and queues it.
+        """
+        self.send(wire.encode_event(data) if self.binary else json.dumps(data))
+
+    def send(self, message):
+        """
+        Queues an encoded message (str or bytes) for this client; never blocks.
+        """
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+            now = time.monotonic()
+            if self._lagging_since is None:
+                self._lagging_since = now
+            elif now - self._lagging_since > CLIENT_LAG_DISCONNECT_SECONDS and not self._disconnecting:
+                log.warning("Disconnecting lagging client %s (%d messages dropped)", self.websocket.remote_address, self.dropped)
+                self._disconnecting = True
+                asyncio.create_task(self.websocket.close(code=1008, reason="client too slow"))
         else:
-            filtered_record[header_key] = record.get(header_key, '')
+            self._lagging_since = None
+        self._queue.put_nowait((message, time.perf_counter_ns()))
 
-    try:
-        with open(CSV_FILENAME, 'a', newline='', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=CSV_HEADER)
-            csvfile.seek(0, os.SEEK_END)
-            if csvfile.tell() == 0:
-                 writer.writeheader()
-            writer.writerow(filtered_record)
-        # Only print confirmation, content is in the file
-        print(f"Logged combined record for cardId {filtered_record.get('cardId', 'N/A')}")
-    except IOError as e:
-        print(f"Error writing to CSV file {CSV_FILENAME}: {e}")
-    except Exception as e:
-        print(f"An unexpected error occurred during CSV writing: {e}")
+    async def _sender(self):
+        try:
+            while True:
+                message, queued_ns = await self._queue.get()
+                await self.websocket.send(message)
+                latency.record('send', queued_ns, time.perf_counter_ns())
+        except websockets.ConnectionClosed:
+            pass
+        except Exception as e:
+            log.error("Error sending message to %s: %s", self.websocket.remote_address, e)
+
+    async def close(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
 
 
-def record_complete(rec):
+class Outgoing:
     """
-    Check if the record contains all required keys using internal key names.
+    A message fanned out to several clients, encoded at most once per wire format.
+    Created from the frame as received, so forwarding it in that same format costs nothing.
     """
-    # Use internal keys: 'answer', 'side', 'side_choice_raw'
-    required = ['cardId', 'side', 'answer', 'question', 'difficulty', 'side_choice_raw', 'Robot', 'gazeDecision']
-    has_all_required = all(key in rec for key in required)
-    return has_all_required
+    __slots__ = ('data', '_text', '_packed')
+
+    def __init__(self, data, raw):
+        self.data = data
+        self._text = raw if isinstance(raw, str) else None
+        self._packed = raw if isinstance(raw, bytes) else None
+
+    def encoded(self, binary):
+        if binary:
+            if self._packed is None:
+                self._packed = wire.encode_event(self.data)
+            return self._packed
+        if self._text is None:
+            self._text = json.dumps(self.data)
+        return self._text
+
+
+class Broadcaster:
+    """
+    All connected clients, with topic-based fan-out through their ClientChannels.
+    """
+
+    def __init__(self):
+        self.channels = set()
+
+    def add(self, websocket, connection_id):
+        channel = ClientChannel(websocket, connection_id)
+        self.channels.add(channel)
+        return channel
+
+    async def remove(self, channel):
+        self.channels.discard(channel)
+        await channel.close()
 
+    def publish(self, topic, message, sender=None, participant=None):
+        """
+        Queues `message` (an Outgoing) for every client (except `sender`) that wants `topic`.
+        Returns the number of recipients.
+        """
+        recipients = 0
+        for channel in self.channels:
+            if channel is not sender and channel.wants(topic, participant):
+                channel.send(message.encoded(channel.binary))
+                recipients += 1
+        return recipients
 
-# Keep track of connected clients.
-connected = set()
+
+broadcaster = Broadcaster()
+_connection_ids = itertools.count(1)
 
 async def handler(websocket):
-    print(f"Client connected: {websocket.remote_address}")
-    connected.add(websocket)
+    connection_id = next(_connection_ids)
+    log.info("Client connected: %s (connection %d)", websocket.remote_address, connection_id,
+             extra={'connection': connection_id})
+    channel = broadcaster.add(websocket, connection_id)
     try:
         async for message in websocket:
+            received_ns = time.perf_counter_ns()
             arrival_time = datetime.now(timezone.utc)
-            # Shorten logged message to prevent excessive console output
-            log_message = message[:150] + ('...' if len(message) > 150 else '')
-            print(f"Message received from {websocket.remote_address} at {arrival_time.isoformat()}: {log_message}")
+            event_type = 'invalid'  # until the message is decoded into an object with a string 'event'
+            if event_journal.filename:
+                # Journal first, before anything can fail, so replay sees exactly what arrived
+                event_journal.record(journal.message_record(received_ns, arrival_time, connection_id, message))
+            if log.isEnabledFor(logging.DEBUG):
+                # Shorten logged message to prevent excessive console output
+                # f-string, not concatenation: binary (msgpack) frames are bytes
+                log_message = f"{message[:150]}{'...' if len(message) > 150 else ''}"
+                log.debug("Message received from %s: %s", websocket.remote_address, log_message,
+                          extra={'connection': connection_id})
 
             try:
-                data = json.loads(message)
+                # Binary frames are msgpack (see wire.py), text frames JSON
+                data = wire.decode_event(message) if isinstance(message, bytes) else json.loads(message)
+                latency.record('parse', received_ns, time.perf_counter_ns())
                 card_id = data.get('cardId')
                 event_type = data.get('event')
+                if not isinstance(event_type, str):
+                    event_type = 'invalid'  # missing or e.g. a list: counted, and broadcast, as 'invalid'
                 participant_name = data.get('participant', '')
 
-                if card_id and card_id not in card_records:
-                     card_records[card_id] = {}
+                # --- Status query (open turns etc.) ---
+                if event_type == 'serverStatus':
+                    channel.reply({"event": "serverStatus", "sessions": sessions.metrics(),
+                                   "latency_ms": latency.snapshot(),
+                                   "csv_rows_written": combined_log.rows_written,
+                                   "peak_rss_mb": peak_rss_mb()})
+                    continue
+
+                # --- Running aggregates, e.g. {"event": "analyticsQuery", "groupBy": ["Robot"],
+                #     "filter": {"participant": "P01"}} (see analytics.py) ---
+                if event_type == 'analyticsQuery':
+                    group_by, filters = data.get('groupBy') or [], data.get('filter') or {}
+                    try:
+                        groups = analytics.query(group_by, filters)
+                    except ValueError as e:
+                        channel.reply({"status": "error", "message": str(e)})
+                        continue
+                    channel.reply({"event": "analytics", "groupBy": group_by, "filter": filters,
+                                   "turns": analytics.turns, "groups": groups})
+                    continue
+
+                # --- Topic subscription (e.g. the GCS subscribes to cardReveal and startRound) ---
+                if event_type == 'subscribe':
+                    topics = data.get('topics', [])
+                    if not isinstance(topics, list) or not all(isinstance(topic, str) for topic in topics):
+                        channel.reply({"status": "error", "message": "topics must be a list of event names"})
+                        continue
+                    channel.subscribe(topics, data.get('participant'))
+                    log.info("Connection %d subscribed to %s%s", connection_id, sorted(channel.topics),
+                             f" for participant {channel.participant!r}" if channel.participant else "",
+                             extra={'connection': connection_id})
+                    channel.reply({"status": "subscribed", "topics": sorted(channel.topics)})
+                    continue
+
+                # --- Broadcast any other messages ---
+                if event_type not in TURN_EVENTS:
+                     recipients = broadcaster.publish(event_type, Outgoing(data, message), sender=channel,
+                                                      participant=participant_name)
+                     log.debug("Broadcast event type %s to %d client(s)", event_type, recipients)
+                     continue
 
-                if card_id and participant_name:
-                     card_records[card_id]['participant'] = participant_name
+                if not card_id:
+                    log.warning("%s event received without cardId.", event_type)
+                    channel.reply({"status": "error", "message": f"{event_type} missing cardId"})
+                    continue # Skip completion check if no cardId
 
-                if card_id:
-                    # Store arrival time of this specific event
-                    card_records[card_id]['event_arrival_timestamp'] = arrival_time
+                turn = apply_turn_event(sessions, event_type, data, connection_id, received_ns, arrival_time)
 
-                # --- Process cardReveal events ---
                 if event_type == 'cardReveal':
-                    if card_id:
-                         card_records[card_id]['reveal_timestamp'] = arrival_time # Store reveal time
-                         print(f"Stored reveal timestamp for cardId {card_id}: {arrival_time.isoformat()}")
-
-                         # Store relevant data using internal keys
-                         data['side'] = data.get('side')
-                         data['answer'] = data.get('answer')
-                         card_records[card_id].update(data) # Update record with all fields from message
-
-
-                         # <<< --- FORWARDING LOOP RE-ADDED --- >>>
-                         print(f"Forwarding cardReveal for {card_id} to other clients...")
-                         forward_tasks = []
-                         for conn in connected.copy():
-                            if conn != websocket: # Don't send back to original sender
-                                try:
-                                    # Use create_task for potentially better concurrency if needed,
-                                    # but simple await is fine for moderate client numbers.
-                                    # print(f"DEBUG: Sending to {conn.remote_address}: {message}") # Optional Debug
-                                    await conn.send(message) # Send the original message string
-                                except websockets.ConnectionClosed:
-                                    print(f"Removing closed connection during forward: {conn.remote_address}")
-                                    connected.remove(conn)
-                                except Exception as e:
-                                    print(f"Error sending message to {conn.remote_address}: {e}")
-                         # <<< --- END OF RE-ADDED LOOP --- >>>
-
-                         # Send status back to the original sender *after* attempting to forward
-                         await websocket.send(json.dumps({"status": "cardReveal processed, stored, and forwarded"}))
-
-                    else: # cardReveal missing cardId
-                        print("Warning: cardReveal event received without cardId.")
-                        await websocket.send(json.dumps({"status": "error", "message": "cardReveal missing cardId"}))
-                    # Skip further processing for this message iteration
-                    continue # IMPORTANT
-
-                # --- Process cardDropped events ---
-                elif event_type == 'cardDropped':
-                    if card_id and card_id in card_records:
-                        drop_time = arrival_time
-                        print(f"Processing drop for cardId {card_id} at {drop_time.isoformat()}")
-
-                        # Store choice using internal key 'side_choice_raw'
-                        data['side_choice_raw'] = data.get('side_choice')
-                        card_records[card_id].update(data)
-
-                        # Calculate Duration using the internal key 'move_duration'
-                        reveal_time = card_records[card_id].get('reveal_timestamp')
-                        if reveal_time:
-                            duration = drop_time - reveal_time
-                            duration_seconds = duration.total_seconds()
-                            card_records[card_id]['move_duration'] = duration_seconds
-                            print(f"Calculated duration for cardId {card_id}: {duration_seconds:.3f}s")
-                        else:
-                            print(f"Warning: cardDropped received for cardId {card_id}, but no reveal_timestamp found.")
-                            card_records[card_id]['move_duration'] = None # Use new key
-
-                    elif not card_id: # cardDropped missing cardId
-                        print("Warning: cardDropped event received without cardId.")
-                        await websocket.send(json.dumps({"status": "error", "message": "cardDropped missing cardId"}))
-                        continue # Skip completion check if no cardId
-                    else: # card_id provided but not in card_records
-                         print(f"Warning: cardDropped received for unknown cardId {card_id}. Storing partial data.")
-                         data['side_choice_raw'] = data.get('side_choice')
-                         card_records[card_id] = data
-                         card_records[card_id]['move_duration'] = None
-
-
-                # --- Process RobotsMove events ---
-                elif event_type == 'RobotsMove':
-                     if card_id and card_id in card_records:
-                         # Update record directly, contains 'Robot', 'gazeDecision' etc.
-                         card_records[card_id].update(data)
-                     elif not card_id:
-                         print("Warning: RobotsMove event received without cardId.")
-                         await websocket.send(json.dumps({"status": "error", "message": "RobotsMove missing cardId"}))
-                         continue # Skip completion check
-                     else: # card_id provided but not in card_records
-                         print(f"Warning: RobotsMove received for unknown cardId {card_id}. Storing partial data.")
-                         card_records[card_id] = data
-
-
-                # --- Check completion and log (now happens after any relevant event) ---
-                if card_id and card_id in card_records:
-                     # Pass the original record with internal keys to record_complete
-                     if record_complete(card_records[card_id]):
-                         print(f"Record complete for cardId {card_id}. Writing to CSV.")
-                         write_combined_record(card_records[card_id]) # Handles mapping/filtering/writing
-                         del card_records[card_id] # Clean up memory
-                         # Send completion status *only* if not triggered by cardReveal (which sent its own status)
-                         if event_type != 'cardReveal':
-                              await websocket.send(json.dumps({"status": "combined record logged"}))
-                     else:
-                         # Send waiting status *only* if not triggered by cardReveal
-                         if event_type != 'cardReveal':
-                              await websocket.send(json.dumps({"status": f"{event_type} stored; waiting for additional info"}))
+                    # Forward to the clients subscribed to cardReveal (queued, sent concurrently)
+                    recipients = broadcaster.publish('cardReveal', Outgoing(data, message), sender=channel,
+                                                     participant=participant_name)
+                    latency.record('forward.cardReveal', received_ns, time.perf_counter_ns())
+                    log.debug("Forwarded cardReveal for %s to %d client(s)", card_id, recipients)
+
+                    # Send status back to the original sender *after* attempting to forward
+                    channel.reply({"status": "cardReveal processed, stored, and forwarded"})
+                    continue # IMPORTANT: no completion check on reveal
+
+                if event_type == 'RobotsMove' and turn.reveal_ns is not None:
+                    # GCS reaction latency: reveal forwarded -> decision received, overall and per condition
+                    latency.record('reveal_to_robots_move', turn.reveal_ns, received_ns)
+                    latency.record(histogram_name('reveal_to_robots_move', turn.robot, ROBOT_CONDITIONS),
+                                   turn.reveal_ns, received_ns)
+
+                # --- Check completion and log (cardDropped / RobotsMove) ---
+                missing = turn.missing_fields()
+                if not missing:
+                     log.debug("Record complete for participant %r, cardId %s. Writing to CSV.", turn.participant, card_id)
+                     write_combined_record(turn.as_record()) # Handles mapping/filtering/writing
+                     latency.record('log', received_ns, time.perf_counter_ns())
+                     sessions.close(turn) # Clean up memory
+                     channel.reply({"status": "combined record logged"})
+                else:
+                     channel.reply({"status": f"{event_type} stored; waiting for additional info"})
 
-                # --- Broadcast any other messages ---
-                elif event_type not in ['cardReveal', 'cardDropped', 'RobotsMove']:
-                     print(f"Broadcasting unknown event type: {event_type}")
-                     for conn in connected.copy():
-                         if conn != websocket:
-                             try:
-                                 await conn.send(message)
-                             except websockets.ConnectionClosed:
-                                 print(f"Removing closed connection during broadcast: {conn.remote_address}")
-                                 connected.remove(conn)
-                             except Exception as e:
-                                 print(f"Error broadcasting message to {conn.remote_address}: {e}")
-
-
-            except json.JSONDecodeError:
-                print(f"Error: Received non-JSON message: {message}") # Log full message on JSON error
+
+            except (json.JSONDecodeError, wire.DecodeError) as e:
+                log.error("Received undecodable message (%s): %r", e, message) # Log full message on decode error
             except Exception as e:
-                import traceback
-                print(f"Error processing message: {e}")
-                print(traceback.format_exc()) # Print full traceback for unexpected errors
-                print(f"Problematic Message Content (start): {message[:500]}")
+                # Full traceback for unexpected errors
+                log.exception("Error processing message: %s. Problematic message content (start): %r", e, message[:500])
+            finally:
+                latency.record(histogram_name('handle', event_type, TURN_EVENTS + CONTROL_EVENTS),
+                               received_ns, time.perf_counter_ns())
+                message_summary.count(event_type)
 
     except websockets.ConnectionClosed as e:
-        print(f"Client disconnected: {websocket.remote_address} - Code: {e.code}, Reason: {e.reason}")
+        log.info("Client disconnected: %s - Code: %s, Reason: %s", websocket.remote_address, e.code, e.reason,
+                 extra={'connection': connection_id})
     except Exception as e:
-        import traceback
-        print(f"An unexpected error occurred in the handler: {e}")
-        print(traceback.format_exc())
+        log.exception("An unexpected error occurred in the handler: %s", e)
 
     finally:
-        connected.discard(websocket)
-        print(f"Connection closed for {websocket.remote_address}. Remaining clients: {len(connected)}")
-
+        await broadcaster.remove(channel)
+        log.info("Connection closed for %s. Remaining clients: %d", websocket.remote_address, len(broadcaster.channels),
+                 extra={'connection': connection_id})
+
+
+async def main(args):
+    initialize_csv_file(args.csv)
+    combined_log.filename = args.csv
+    partial_log.filename = args.partial_csv
+    event_journal.filename = args.journal
+    await combined_log.start()
+    await partial_log.start()
+    if event_journal.filename:
+        await event_journal.start()
+        event_journal.record({'type': 'start', 'mono': time.perf_counter_ns(),
+                              'wall': datetime.now(timezone.utc).isoformat()})
+    eviction_task = asyncio.create_task(evict_stale_turns())
+    # Clients may negotiate msgpack frames (wire.EVENTS_PROTOCOL); all others get JSON
+    server = await websockets.serve(handler, args.host, args.port,
+                                    select_subprotocol=wire.select_subprotocol(wire.event_protocols()))
+    log.info("WebSocket logging server started on ws://%s:%d", args.host, args.port)
+
+    # Ctrl-C / SIGTERM end the wait below, so the shutdown runs as ordinary code in this task. Relying
+    # on KeyboardInterrupt instead would let Python 3.10's asyncio.run cancel the writer tasks too,
+    # losing their last batch.
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stop.set)
+        except NotImplementedError:
+            pass  # Windows: Ctrl-C raises KeyboardInterrupt, and Python 3.11+ cancels only this task
+    try:
+        await stop.wait()
+        log.info("Shutting down...")
+    finally:
+        # Stop accepting messages, then flush every queued row
+        eviction_task.cancel()
+        server.close()
+        await server.wait_closed()
+        await combined_log.close()
+        await partial_log.close()
+        await event_journal.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="WebSocket logging server for the sorting game and the GCS")
+    parser.add_argument("--host", default="0.0.0.0", help="interface to listen on (default: 0.0.0.0)")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on (default: 8765)")
+    parser.add_argument("--csv", default=CSV_FILENAME, help=f"combined record log (default: {CSV_FILENAME})")
+    parser.add_argument("--partial-csv", default=PARTIAL_CSV_FILENAME,
+                        help=f"log for evicted incomplete turns (default: {PARTIAL_CSV_FILENAME})")
+    parser.add_argument("--journal", default=JOURNAL_FILENAME,
+                        help=f"append-only log of every received message, replayable with journal.py "
+                             f"(default: {JOURNAL_FILENAME}; '' to disable)")
+    logsetup.add_arguments(parser, default_json=JSON_LOG_FILENAME)
+    return parser.parse_args(argv)
 
-async def main():
-    initialize_csv_file()
-    server = await websockets.serve(handler, "0.0.0.0", 8765)
-    print("WebSocket logging server started on ws://0.0.0.0:8765")
-    await asyncio.Future() # Run forever
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    args = parse_args()
+    log_listener = logsetup.configure('server', args.log_level, args.log_json)
+    try:
+        asyncio.run(main(args))
+        log.info("Server stopped.")
+    except KeyboardInterrupt:
+        log.info("Server stopped.")
+    finally:
+        log_listener.stop()
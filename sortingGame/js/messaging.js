@@ -12,6 +12,8 @@ function connectWebSocket() {
 
     messagingSocket.onopen = () => {
         console.log("Messaging WebSocket connected");
+        // The game only needs replies to its own messages, not forwarded events (e.g. other stations' cardReveal)
+        messagingSocket.send(JSON.stringify({ event: "subscribe", topics: [] }));
         // Send any queued messages.
         while (messageQueue.length > 0) {
             const msg = messageQueue.shift();
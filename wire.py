@@ -0,0 +1,111 @@
+"""
+Optional binary wire formats for the perception (8766) and logging (8765) sockets.
+
+Clients opt in with a WebSocket subprotocol when they connect; clients that offer none keep
+getting JSON text frames:
+    FACE_DETECTION_PROTOCOL  perception.py sends faceDetection as fixed-layout struct frames
+    EVENTS_PROTOCOL          server.py sends events and replies as msgpack binary frames
+Binary frames received by server.py are always decoded as msgpack, whatever was negotiated.
+perception.py's other messages (perceptionStatus) stay JSON text frames.
+msgpack is optional: without it, server.py does not offer EVENTS_PROTOCOL.
+
+faceDetection frame (little-endian, FACE_DETECTION_STRUCT, 64 bytes):
+    uint8   type (FACE_DETECTION_TYPE)
+    uint8   flags (bit 0: userInFront)
+    uint8   headDirection code (DIRECTIONS index)
+    uint8   gazeDirection code (DIRECTIONS index, 0 = no gaze)
+    float32 faceX, faceY, secondFaceX, secondFaceY, headYaw, headPitch, headRoll,
+            gazeX, gazeY, irisX, irisY                        (NaN = null)
+    float64 timestamps.headPose, timestamps.gaze             (ms since the epoch, NaN = null)
+gcs/js/wire.js decodes the same layout.
+"""
+import math
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+FACE_DETECTION_PROTOCOL = "gaze-struct.v1"
+EVENTS_PROTOCOL = "gaze-msgpack.v1"
+
+FACE_DETECTION_TYPE = 1
+FACE_DETECTION_STRUCT = struct.Struct("<4B11f2d")
+FACE_FLOAT_KEYS = ("faceX", "faceY", "secondFaceX", "secondFaceY", "headYaw", "headPitch", "headRoll",
+                   "gazeX", "gazeY", "irisX", "irisY")
+TIMESTAMP_KEYS = ("headPose", "gaze")
+
+# headDirection / gazeDirection codes; None (no gaze estimate) is 0
+DIRECTIONS = (None, "Looking Forward", "Looking Left", "Looking Right", "Looking At Cards")
+_DIRECTION_CODES = {direction: code for code, direction in enumerate(DIRECTIONS)}
+
+NAN = float("nan")
+
+
+class DecodeError(ValueError):
+    pass
+
+
+def select_subprotocol(supported):
+    """
+    select_subprotocol hook for websockets.serve(): picks the first offered subprotocol that is
+    in `supported`, and accepts the connection without one (plain JSON) otherwise.
+    """
+    def select(connection, offered):
+        for subprotocol in offered:
+            if subprotocol in supported:
+                return subprotocol
+        return None
+    return select
+
+
+def event_protocols():
+    """
+    Subprotocols server.py can offer (EVENTS_PROTOCOL needs msgpack).
+    """
+    return (EVENTS_PROTOCOL,) if msgpack is not None else ()
+
+
+def encode_face_detection(message):
+    timestamps = message.get("timestamps") or {}
+    floats = [NAN if message.get(key) is None else message[key] for key in FACE_FLOAT_KEYS]
+    stamps = [NAN if timestamps.get(key) is None else timestamps[key] for key in TIMESTAMP_KEYS]
+    return FACE_DETECTION_STRUCT.pack(
+        FACE_DETECTION_TYPE,
+        1 if message["userInFront"] else 0,
+        _DIRECTION_CODES.get(message["headDirection"], 1),
+        _DIRECTION_CODES.get(message.get("gazeDirection"), 0),
+        *floats, *stamps)
+
+
+def decode_face_detection(data):
+    if len(data) != FACE_DETECTION_STRUCT.size or data[0] != FACE_DETECTION_TYPE:
+        raise DecodeError(f"not a faceDetection frame ({len(data)} bytes)")
+    values = FACE_DETECTION_STRUCT.unpack(data)
+    _, flags, head_code, gaze_code = values[:4]
+    floats = values[4:4 + len(FACE_FLOAT_KEYS)]
+    stamps = values[4 + len(FACE_FLOAT_KEYS):]
+    message = {"event": "faceDetection", "userInFront": bool(flags & 1),
+               "headDirection": DIRECTIONS[head_code], "gazeDirection": DIRECTIONS[gaze_code]}
+    for key, value in zip(FACE_FLOAT_KEYS, floats):
+        message[key] = None if math.isnan(value) else value
+    message["timestamps"] = {key: None if math.isnan(value) else round(value)
+                             for key, value in zip(TIMESTAMP_KEYS, stamps)}
+    return message
+
+
+def encode_event(message):
+    return msgpack.packb(message, use_bin_type=True)
+
+
+def decode_event(data):
+    if msgpack is None:
+        raise DecodeError("binary message received but msgpack is not installed")
+    try:
+        message = msgpack.unpackb(data, raw=False)
+    except ValueError as e:
+        raise DecodeError(f"invalid msgpack message: {e}") from e
+    if not isinstance(message, dict):
+        raise DecodeError("msgpack message is not a map")
+    return message